@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Thin client of assay_server.py: run an analysis script command line on the
+resident server, e.g.
+assay_client.py aa sample.dat out --formats png
+instead of
+triplicate_aa_plot.py sample.dat out --formats png
+Without a running server the script is run directly.
+"""
+import os
+import sys
+import json
+import socket
+import getpass
+import argparse
+import tempfile
+import subprocess
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# job names and the scripts they run; both modules must provide build_parser and main(argv)
+SCRIPTS = {'aa': 'triplicate_aa_plot.py', 'poly': 'triplicate-poly-phe-synthesis.py'}
+
+
+def default_socket():
+    """
+    :return: the socket path of the server, $ASSAY_SOCKET or one per user in the
+    temporary directory
+    """
+    return os.environ.get('ASSAY_SOCKET') or os.path.join(tempfile.gettempdir(), 'assay-%s.sock' % getpass.getuser())
+
+
+def token_file(port):
+    """
+    :param port: localhost TCP port of the server
+    :return: the file, readable by its owner only, holding the token that the jobs
+    sent to the port must carry
+    """
+    return os.path.join(os.path.expanduser('~'), '.assay-server-%d.token' % port)
+
+
+def connect(socket_path=None, port=None):
+    """
+    :param socket_path: Unix socket of the server, defaults to default_socket()
+    :param port: localhost TCP port of the server instead of a Unix socket
+    :return: a socket connected to the server
+    """
+    if port is not None:
+        return socket.create_connection(('127.0.0.1', port))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path or default_socket())
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def submit(script, argv, socket_path=None, port=None, cwd=None):
+    """
+    :param script: a key of SCRIPTS
+    :param argv: command line arguments of the script
+    :param socket_path: Unix socket of the server, see connect
+    :param port: localhost TCP port of the server, see connect
+    :param cwd: directory the relative paths of argv refer to, defaults to the current one
+    :return: the reply of the server, see assay_server.run_job
+    """
+    request = {'script': script, 'argv': list(argv), 'cwd': os.path.abspath(cwd or os.getcwd())}
+    if port is not None:
+        # any local user can connect to a TCP port, the token shows that the job comes from the server's user
+        with open(token_file(port), 'r') as ifile:
+            request['token'] = ifile.read().strip()
+    with connect(socket_path, port) as sock:
+        sock.sendall((json.dumps(request) + '\n').encode())
+        with sock.makefile('rb') as reply:
+            line = reply.readline()
+    if not line:
+        raise ConnectionError("the server closed the connection without a reply")
+    return json.loads(line)
+
+
+def main():
+    # Read variables from the command line
+    parser = argparse.ArgumentParser(description="Run an assay analysis script on the resident server")
+    parser.add_argument('--socket', default=None, help="Unix socket of the server (default: $ASSAY_SOCKET or %s)"
+                        % default_socket())
+    parser.add_argument('--port', type=int, default=None, help="localhost TCP port of the server instead")
+    parser.add_argument('--files', action='store_true', help="list the files written by the job on stderr")
+    parser.add_argument('script', choices=sorted(SCRIPTS), help="script to run")
+    parser.add_argument('argv', nargs=argparse.REMAINDER, help="arguments of the script")
+    args = parser.parse_args()
+
+    try:
+        reply = submit(args.script, args.argv, args.socket, args.port)
+    except OSError:
+        # no server, pay for the imports and run the script here
+        sys.exit(subprocess.call([sys.executable, os.path.join(SCRIPT_DIR, SCRIPTS[args.script])] + args.argv))
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    if args.files:
+        for file_name in reply['files']:
+            sys.stderr.write(file_name + '\n')
+    sys.exit(reply['status'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Fast loading of the numeric text files read by the analysis scripts.  Files are
+parsed in one go with numpy's C parser instead of line by line, and the parsed
+arrays can be kept in a sidecar directory of .npy files that later runs
+memory-map instead of parsing the text again.
+"""
+import os
+import json
+import hashlib
+import collections
+import warnings
+import numpy as np
+
+
+CACHE_SUFFIX = '.cache'  # sidecar directory holding the parsed arrays of an input file
+DELIMITERS = (',', '\t', ';')  # tried in this order, whitespace otherwise
+SNIFF_BYTES = 1 << 16
+# np.loadtxt is implemented in C from numpy 1.23 on and then beats parse_floats
+C_LOADTXT = np.lib.NumpyVersion(np.__version__) >= '1.23.0'
+load_counters = collections.Counter()  # files load_cached took from the cache ('hits') or parsed ('misses')
+
+
+def parse_floats(text, source='input'):
+    """
+    :param text: str of numbers separated by whitespace
+    :param source: name of the input, for the error message
+    :return: flat float array of all the numbers in text
+    """
+    with warnings.catch_warnings():
+        # older numpy only warns when it cannot parse the whole string, newer numpy raises
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, sep=' ')
+        except (DeprecationWarning, ValueError):
+            raise ValueError("%s contains entries that are not numbers" % source)
+
+
+def _is_number(token):
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
+
+def sniff_table(in_file_name):
+    """
+    :param in_file_name: input file name
+    :return: dict of the delimiter (None for whitespace), the number of columns,
+    the byte offset where the numeric block starts and the header lines before it
+    Only the start of the file is read.  Empty lines, comment lines starting with
+    # and lines that are not all numbers (column names) before the first row of
+    numbers make up the header.
+    """
+    with open(in_file_name, 'rb') as ifile:
+        head = ifile.read(SNIFF_BYTES)
+    offset = 0
+    header = []
+    for raw in head.splitlines(True):
+        line = raw.decode('ascii', 'replace').strip()
+        delimiter = next((d for d in DELIMITERS if d in line), None)
+        tokens = [t.strip() for t in line.split(delimiter)] if delimiter else line.split()
+        if line and not line.startswith('#') and all(_is_number(t) for t in tokens):
+            return {'delimiter': delimiter, 'n_col': len(tokens), 'offset': offset, 'header': header}
+        header.append(line)
+        offset += len(raw)
+    raise ValueError("%s has no rows of numbers in its first %d bytes" % (in_file_name, SNIFF_BYTES))
+
+
+def parse_matrix(in_file_name):
+    """
+    :param in_file_name: input file name
+    :return: 2D float array of the numeric block of the file, one row per line
+    Sniff the layout once, then hand the whole numeric block to the C loadtxt of
+    newer numpy, or to parse_floats on older numpy.
+    """
+    table = sniff_table(in_file_name)
+    with open(in_file_name, 'rb') as ifile:
+        ifile.seek(table['offset'])
+        if C_LOADTXT:
+            return np.loadtxt(ifile, delimiter=table['delimiter'], ndmin=2)
+        text = ifile.read()
+    if table['delimiter'] is not None:
+        text = text.replace(table['delimiter'].encode('ascii'), b' ')
+    flat = parse_floats(text.decode('ascii'), in_file_name)
+    if len(flat) % table['n_col']:
+        raise ValueError("%s has rows that do not have %d columns" % (in_file_name, table['n_col']))
+    return flat.reshape(-1, table['n_col'])
+
+
+def file_signature(in_file_name, with_hash=True):
+    """
+    :param in_file_name: input file name
+    :param with_hash: whether to also hash the content of the file
+    :return: a dict of the size, mtime and (optionally) sha1 of the file
+    """
+    stat = os.stat(in_file_name)
+    signature = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if with_hash:
+        sha1 = hashlib.sha1()
+        with open(in_file_name, 'rb') as ifile:
+            for chunk in iter(lambda: ifile.read(1 << 20), b''):
+                sha1.update(chunk)
+        signature['sha1'] = sha1.hexdigest()
+    return signature
+
+
+def _replace_file(file_name, write):
+    # write to a temporary name next to file_name, then swap it in, so that
+    # readers (and memory maps of the old file) never see a partial file
+    tmp_file_name = "%s.%d.tmp" % (file_name, os.getpid())
+    with open(tmp_file_name, 'wb') as ofile:
+        write(ofile)
+    os.replace(tmp_file_name, file_name)
+
+
+def _write_signature(cache_dir, signature):
+    _replace_file(os.path.join(cache_dir, 'signature.json'), lambda ofile: ofile.write(json.dumps(signature).encode()))
+
+
+def save_arrays(arrays, in_file_name, cache_dir):
+    """
+    :param arrays: dict of the arrays parsed from in_file_name
+    :param in_file_name: input file name
+    :param cache_dir: the sidecar directory to write
+    :return:
+    Other processes may be reading the cache, or have its arrays memory-mapped,
+    so the old signature is removed first and every array is swapped in whole.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        os.remove(os.path.join(cache_dir, 'signature.json'))
+    except FileNotFoundError:
+        pass
+    for name, array in arrays.items():
+        _replace_file(os.path.join(cache_dir, name + '.npy'), lambda ofile: np.save(ofile, array))
+    # the signature is written last, so a half-written cache is never valid
+    _write_signature(cache_dir, file_signature(in_file_name))
+
+
+def load_arrays(in_file_name, cache_dir, names):
+    """
+    :param in_file_name: input file name
+    :param cache_dir: the sidecar directory to read
+    :param names: names of the arrays to load
+    :return: dict of memory-mapped arrays, or None if the cache is missing or stale
+    The cache is stale when the size of the input file changed, or when its mtime
+    changed and its content hash does not match any more.
+    """
+    try:
+        with open(os.path.join(cache_dir, 'signature.json'), 'r') as ifile:
+            cached = json.load(ifile)
+        current = file_signature(in_file_name, with_hash=False)
+        if current['size'] != cached['size']:
+            return None
+        if current['mtime'] != cached['mtime']:
+            current = file_signature(in_file_name)
+            if current['sha1'] != cached['sha1']:
+                return None
+            # only touched, remember the new mtime so that the next run skips hashing
+            _write_signature(cache_dir, current)
+        return dict((name, np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r'))
+                    for name in names)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_cached(in_file_name, parse, names, cache_dir=None):
+    """
+    :param in_file_name: input file name
+    :param parse: function parsing in_file_name into a dict of arrays
+    :param names: names of the arrays parse returns
+    :param cache_dir: the sidecar cache directory, defaults to in_file_name + CACHE_SUFFIX
+    :return: dict of the arrays
+    Reuse the cache of an earlier run when it is still valid, otherwise parse the
+    file and write the cache.
+    """
+    if cache_dir is None:
+        cache_dir = in_file_name + CACHE_SUFFIX
+    arrays = load_arrays(in_file_name, cache_dir, names)
+    if arrays is not None:
+        load_counters['hits'] += 1
+    else:
+        load_counters['misses'] += 1
+        arrays = parse(in_file_name)
+        try:
+            save_arrays(arrays, in_file_name, cache_dir)
+        except OSError:
+            # a read-only data directory just means no cache
+            pass
+    return arrays
+
+
+def load_matrix(in_file_name, cache_dir=None, cache=True):
+    """
+    :param in_file_name: input file name
+    :param cache_dir: the sidecar cache directory, defaults to in_file_name + CACHE_SUFFIX
+    :param cache: whether to use the sidecar cache
+    :return: 2D float array of the numeric block of the file, memory-mapped when
+    it comes from the cache
+    A drop-in replacement of np.loadtxt for plain numeric tables.
+    """
+    if not cache:
+        return parse_matrix(in_file_name)
+    return load_cached(in_file_name, lambda name: {'matrix': parse_matrix(name)}, ('matrix',), cache_dir)['matrix']
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+Resident analysis service.  The server keeps numpy, scipy, matplotlib and the
+analysis scripts loaded in a bounded pool of worker processes and runs their
+command lines as jobs sent over a Unix socket (or a localhost TCP port), so a job
+does not pay for interpreter start and imports.  See assay_client.py.
+
+Each request and each reply is one line of json on the connection:
+{"script": "aa", "argv": ["sample.dat", "out", "--formats", "png"], "cwd": "/data"}
+{"status": 0, "stdout": "...", "stderr": "", "files": ["/data/out.png"], "seconds": 0.05}
+The Unix socket is only open to the user running the server.  On a TCP port,
+which any local user can connect to, a request must also carry the token the
+server writes to assay_client.token_file(port), readable by its user only.
+"""
+import os
+import io
+import sys
+import glob
+import hmac
+import json
+import time
+import signal
+import socket
+import secrets
+import argparse
+import threading
+import traceback
+import contextlib
+import socketserver
+import importlib
+import importlib.util
+import concurrent.futures
+import concurrent.futures.process
+from assay_client import SCRIPT_DIR, SCRIPTS, default_socket, token_file
+
+
+_worker_scripts = {}  # the loaded script modules of a worker, by job name
+
+
+def load_script(name):
+    """
+    :param name: a key of SCRIPTS
+    :return: the module of the script
+    triplicate_aa_plot is imported under its own name, so that the process pools it
+    starts itself can find its functions.
+    """
+    file_name = os.path.join(SCRIPT_DIR, SCRIPTS[name])
+    module_name = os.path.splitext(SCRIPTS[name])[0].replace('-', '_')
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    if SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, SCRIPT_DIR)
+    if module_name == os.path.splitext(SCRIPTS[name])[0]:
+        return importlib.import_module(module_name)
+    spec = importlib.util.spec_from_file_location(module_name, file_name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _warm_worker():
+    # pool initializer: load the scripts, scipy and pyplot and build the font cache once per worker
+    for name in SCRIPTS:
+        _worker_scripts[name] = load_script(name)
+    importlib.import_module('scipy.optimize')
+    importlib.import_module('scipy.stats')
+    _worker_scripts['aa']._warm_renderer()
+
+
+def _output_files(prefix, since):
+    # files written since the job started under its output prefix, or in its output directory
+    if not prefix:
+        return []
+    names = glob.glob(glob.escape(prefix) + '*')
+    if os.path.isdir(prefix):
+        names += glob.glob(os.path.join(glob.escape(prefix), '*'))
+    return sorted(set(os.path.abspath(name) for name in names
+                      if os.path.isfile(name) and os.path.getmtime(name) >= since))
+
+
+def run_job(script, argv, cwd):
+    """
+    :param script: a key of SCRIPTS
+    :param argv: command line arguments of the script
+    :param cwd: directory the relative paths of argv refer to
+    :return: dict of the exit status, the captured stdout and stderr, the files
+    written under the output prefix and the seconds the job took
+    """
+    start = time.perf_counter()
+    since = time.time()
+    stdout, stderr = io.StringIO(), io.StringIO()
+    status = 0
+    prefix = None
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            if script not in _worker_scripts:
+                raise SystemExit("unknown script %s, expected one of %s" % (script, ", ".join(sorted(SCRIPTS))))
+            os.chdir(cwd)
+            # usage and error messages name the script, as when it is run directly
+            sys.argv = [SCRIPTS[script]] + list(argv)
+            module = _worker_scripts[script]
+            args = module.build_parser().parse_args(argv)
+            if getattr(args, 'watch', None) is not None:
+                raise SystemExit("--watch does not end, run it without the server")
+            prefix = args.out_file_prefix
+            module.main(argv)
+        except SystemExit as err:
+            if isinstance(err.code, int) or err.code is None:
+                status = err.code or 0
+            else:
+                sys.stderr.write("%s\n" % err.code)
+                status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+            # do not leave the figures of a failed job behind in this worker
+            if 'matplotlib.pyplot' in sys.modules:
+                sys.modules['matplotlib.pyplot'].close('all')
+    return {'status': status, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(),
+            'files': _output_files(prefix, since), 'seconds': time.perf_counter() - start}
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """
+    Run the jobs of one connection, one json line each, in the worker pool of the
+    server.
+    """
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if self.server.token is not None and not hmac.compare_digest(str(request.get('token')),
+                                                                             self.server.token):
+                    raise PermissionError("the job does not carry the token of the server")
+                if request.get('script') == 'ping':
+                    reply = {'status': 0, 'pid': os.getpid()}
+                else:
+                    # wait for a free slot, so that a flood of jobs does not queue up without bound
+                    with self.server.slots:
+                        job = (run_job, request['script'], list(request['argv']), request.get('cwd', os.getcwd()))
+                        executor = self.server.executor
+                        try:
+                            future = executor.submit(*job)
+                        except concurrent.futures.process.BrokenProcessPool:
+                            # the pool broke before this job: run it on a new one
+                            self.server.replace_pool(executor)
+                            executor = self.server.executor
+                            future = executor.submit(*job)
+                        try:
+                            reply = future.result()
+                        except concurrent.futures.process.BrokenProcessPool:
+                            # the pool broke while running this job, which may be the cause: report it
+                            self.server.replace_pool(executor)
+                            raise
+            except Exception as err:
+                reply = {'status': 1, 'stdout': '', 'stderr': "%s: %s\n" % (type(err).__name__, err), 'files': []}
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+            self.wfile.flush()
+
+
+def start_pool(workers):
+    """
+    :param workers: number of worker processes
+    :return: a ProcessPoolExecutor whose workers are all started and warm
+    """
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker)
+    concurrent.futures.wait([executor.submit(os.getpid) for _ in range(workers)])
+    return executor
+
+
+class PoolMixIn:
+    """
+    Worker pool of a job server.  A worker that dies (killed for memory, crashed)
+    breaks the whole pool, so the pool is then replaced by a new one.
+    """
+    def use_pool(self, executor, workers):
+        """
+        :param executor: a pool from start_pool
+        :param workers: its number of worker processes
+        :return:
+        """
+        self.executor = executor
+        self.workers = workers
+        self.pool_lock = threading.Lock()
+
+    def replace_pool(self, broken):
+        """
+        :param broken: the executor a job found broken
+        :return:
+        Only the first of the jobs that found the same pool broken replaces it.
+        """
+        with self.pool_lock:
+            if self.executor is broken:
+                sys.stderr.write("a worker died, restarting the %d workers\n" % self.workers)
+                self.executor = start_pool(self.workers)
+                broken.shutdown(wait=False)
+
+
+class UnixJobServer(PoolMixIn, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPJobServer(PoolMixIn, socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _socket_in_use(path):
+    # whether a server already answers on the socket path
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def _stop(signum, frame):
+    # stop serving on SIGTERM as on Ctrl-C
+    raise KeyboardInterrupt
+
+
+def serve(socket_path=None, port=None, workers=None, queue=None):
+    """
+    :param socket_path: Unix socket to listen on, defaults to default_socket()
+    :param port: listen on this localhost TCP port instead of a Unix socket
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param queue: number of jobs running or waiting for a worker at once, defaults
+    to 4 per worker; further jobs wait for a slot before they are queued
+    :return:
+    """
+    workers = workers or os.cpu_count() or 1
+    # start and warm every worker before accepting jobs
+    executor = start_pool(workers)
+    token = None
+    if port is not None:
+        server = TCPJobServer(('127.0.0.1', port), JobHandler)
+        address = "127.0.0.1:%d" % port
+        token = secrets.token_hex(16)
+        # a new file, so that it is created readable by this user only
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(token_file(port))
+        with os.fdopen(os.open(token_file(port), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as ofile:
+            ofile.write(token + '\n')
+    else:
+        socket_path = socket_path or default_socket()
+        if os.path.exists(socket_path):
+            if _socket_in_use(socket_path):
+                executor.shutdown()
+                raise RuntimeError("a server is already listening on %s" % socket_path)
+            os.unlink(socket_path)
+        server = UnixJobServer(socket_path, JobHandler)
+        os.chmod(socket_path, 0o600)
+        address = socket_path
+    server.use_pool(executor, workers)
+    server.token = token
+    server.slots = threading.BoundedSemaphore(queue or 4 * workers)
+    signal.signal(signal.SIGTERM, _stop)
+    sys.stderr.write("serving %d workers on %s\n" % (workers, address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown()
+        if port is None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        if port is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(token_file(port))
+
+
+def main():
+    # Read variables from the command line
+    parser = argparse.ArgumentParser(description="Keep the assay analysis scripts loaded and run their jobs")
+    parser.add_argument('--socket', default=None, help="Unix socket to listen on (default: $ASSAY_SOCKET or %s)"
+                        % default_socket())
+    parser.add_argument('--port', type=int, default=None,
+                        help="listen on this localhost TCP port instead, open to every local user: jobs must "
+                             "carry the token written to ~/.assay-server-PORT.token")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--queue', type=int, default=None,
+                        help="jobs running or waiting for a worker at once (default: 4 per worker)")
+    args = parser.parse_args()
+    serve(args.socket, args.port, args.workers, args.queue)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Compare building every fit figure from scratch with updating one FitFigureTemplate.
+Usage: bench_figures.py [number of figures] [formats]
+"""
+import sys
+import shutil
+import tempfile
+import os
+from time import perf_counter
+import numpy as np
+import triplicate_aa_plot
+from figure_export import parse_formats
+
+
+def make_datasets(num_figures, seed=0):
+    """
+    :return: list of (time, average, standard deviation, fitted parameters)
+    """
+    rng = np.random.default_rng(seed)
+    time_array = np.array([0, 1, 2, 5, 10, 15, 20, 30], dtype=float)
+    datasets = []
+    for i in range(num_figures):
+        pars = np.array([rng.uniform(1, 3.5), rng.uniform(0.05, 0.5)])
+        ave_conc_array = triplicate_aa_plot.fitfunc(time_array, *pars) + 0.05 * rng.standard_normal(len(time_array))
+        datasets.append((time_array, ave_conc_array, np.full(len(time_array), 0.1), pars))
+    return datasets
+
+
+def main():
+    num_figures = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    formats = parse_formats(sys.argv[2]) if len(sys.argv) > 2 else triplicate_aa_plot.DEFAULT_FORMATS
+    datasets = make_datasets(num_figures)
+    out_dir = tempfile.mkdtemp()
+    try:
+        triplicate_aa_plot.FitFigureTemplate().close()  # load matplotlib before timing
+
+        start = perf_counter()
+        for i, dataset in enumerate(datasets):
+            triplicate_aa_plot.draw_fit_figure(*dataset, fig_prefix=os.path.join(out_dir, "new%d" % i),
+                                               formats=formats)
+        rebuild = (perf_counter() - start) / num_figures
+
+        start = perf_counter()
+        template = triplicate_aa_plot.FitFigureTemplate()
+        for i, dataset in enumerate(datasets):
+            template.update(*dataset)
+            template.save(os.path.join(out_dir, "tpl%d" % i), formats)
+        template.close()
+        reuse = (perf_counter() - start) / num_figures
+    finally:
+        shutil.rmtree(out_dir)
+
+    print("%d figures, formats %s" % (num_figures, ",".join(formats)))
+    print("rebuild per figure   %.1f ms" % (rebuild * 1000))
+    print("template per figure  %.1f ms" % (reuse * 1000))
+    print("saved per figure     %.1f ms (%.0f%%)" % ((rebuild - reuse) * 1000, 100 * (rebuild - reuse) / rebuild))
+
+
+if __name__ == "__main__":
+    main()
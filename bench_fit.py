@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Count the optimizer evaluations of curve_fit per fit, started from (1, 1) with a
+finite-difference Jacobian as fit() used to, and started from initial_guess with
+the analytic fitjac as fit() does now.
+Usage: bench_fit.py [number of curves]
+"""
+import sys
+import warnings
+import numpy as np
+import scipy.optimize
+import triplicate_aa_plot
+
+
+def make_corpus(num_curves, seed=0):
+    """
+    :param num_curves: number of synthetic curves
+    :param seed: seed of the random parameters and noise
+    :return: time array and num_curves x N concentration matrix
+    Time in minutes and concentrations in uM, as in the assay files.
+    """
+    rng = np.random.default_rng(seed)
+    time_array = np.array([0, 1, 2, 5, 10, 15, 20, 30], dtype=float)
+    plateau = rng.uniform(0.5, 5, num_curves)
+    rate = rng.uniform(0.02, 1.5, num_curves)
+    conc_matrix = plateau[:, None] * (1 - np.exp(-rate[:, None] * time_array))
+    conc_matrix += 0.02 * plateau[:, None] * rng.standard_normal(conc_matrix.shape)
+    return time_array, conc_matrix
+
+
+def count_evaluations(time_array, conc_matrix, **kwargs):
+    """
+    :return: function evaluations and Jacobian evaluations of every fit, nan for failed fits
+    """
+    nfev, njev = [], []
+    for conc_array in conc_matrix:
+        p0 = triplicate_aa_plot.initial_guess(conc_array, time_array) if 'jac' in kwargs else None
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                pars, pcov, info, msg, ier = scipy.optimize.curve_fit(
+                    triplicate_aa_plot.fitfunc, time_array, conc_array, p0=p0, full_output=True, **kwargs)
+            nfev.append(info['nfev'])
+            njev.append(info.get('njev', 0))
+        except RuntimeError:
+            nfev.append(np.nan)
+            njev.append(np.nan)
+    return np.array(nfev), np.array(njev)
+
+
+def main():
+    num_curves = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    time_array, conc_matrix = make_corpus(num_curves)
+    print("%d curves, %d time points" % (num_curves, len(time_array)))
+    print("%-28s %10s %10s %8s" % ("", "nfev/fit", "njev/fit", "failed"))
+    for name, kwargs in (("default p0, numerical jac", {}),
+                         ("initial_guess, fitjac", {'jac': triplicate_aa_plot.fitjac})):
+        nfev, njev = count_evaluations(time_array, conc_matrix, **kwargs)
+        print("%-28s %10.1f %10.1f %8d" % (name, np.nanmean(nfev), np.nanmean(njev), np.sum(np.isnan(nfev))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Measure the import time of the plotting scripts with python -X importtime and
+check that importing them does not pull in scipy or matplotlib.
+Usage: bench_import.py [--repeat N] [--max-ms MS]
+Exits with 1 when a heavy module is imported at load time or the best total
+import time is above MS.
+"""
+import sys
+import os
+import argparse
+import subprocess
+
+HEAVY_MODULES = ('scipy', 'matplotlib')
+HERE = os.path.dirname(os.path.abspath(__file__))
+TARGETS = (
+    ('triplicate_aa_plot', "import triplicate_aa_plot"),
+    ('triplicate-poly-phe-synthesis',
+     "import importlib.util\n"
+     "spec = importlib.util.spec_from_file_location('poly_phe', 'triplicate-poly-phe-synthesis.py')\n"
+     "spec.loader.exec_module(importlib.util.module_from_spec(spec))"),
+)
+
+
+def import_time(code):
+    """
+    :param code: python code to run in a fresh interpreter
+    :return: total import time in ms, and the set of top-level packages imported
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=HERE,
+                          stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total_us = 0
+    packages = set()
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        total_us += int(self_us)
+        packages.add(name.strip().split('.')[0])
+    return total_us / 1000.0, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark of the plotting scripts")
+    parser.add_argument('--repeat', type=int, default=5, help="number of fresh interpreters per script")
+    parser.add_argument('--max-ms', type=float, default=None, help="fail above this import time")
+    args = parser.parse_args()
+
+    failed = False
+    print("%-32s %10s  %s" % ("Script", "best ms", "heavy modules"))
+    for name, code in TARGETS:
+        runs = [import_time(code) for i in range(args.repeat)]
+        best = min(ms for ms, packages in runs)
+        heavy = sorted(set(HEAVY_MODULES) & runs[0][1])
+        print("%-32s %10.1f  %s" % (name, best, ", ".join(heavy) or "-"))
+        if heavy or (args.max_ms is not None and best > args.max_ms):
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
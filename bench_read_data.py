@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Compare the line-by-line read_data loop with the vectorized read_data_bulk, on a
+well-formed file and on one with an extra column that both must ignore.
+Usage: bench_read_data.py [number of reactions] [number of time points]
+"""
+import sys
+import os
+import tempfile
+import timeit
+import numpy as np
+import triplicate_aa_plot
+from benchmark_assay import write_assay_file
+
+
+def check_equivalent(in_file_name):
+    loop = triplicate_aa_plot.read_data(in_file_name)
+    bulk = triplicate_aa_plot.read_data_bulk(in_file_name)
+    assert len(loop) == len(bulk)
+    for a, b in zip(loop, bulk):
+        assert np.array_equal(a.time_array, b.time_array) and np.array_equal(a.cpm_array, b.cpm_array)
+        assert a.sa == b.sa and a.aa_conc == b.aa_conc
+
+
+def add_column(in_file_name, out_file_name):
+    # copy of the input with an extra entry on every time point line
+    with open(in_file_name, 'r') as ifile, open(out_file_name, 'w') as ofile:
+        for line in ifile:
+            entries = line.split()
+            if entries and entries[0] not in ('conc', 'sa'):
+                entries.append('1')
+            ofile.write(' '.join(entries) + '\n')
+
+
+def main():
+    num_rxns = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_tp = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    fd, in_file_name = tempfile.mkstemp(suffix='.dat')
+    os.close(fd)
+    try:
+        write_assay_file(in_file_name, num_rxns, num_tp)
+        check_equivalent(in_file_name)
+        add_column(in_file_name, in_file_name + '.extra')
+        try:
+            check_equivalent(in_file_name + '.extra')
+        finally:
+            os.remove(in_file_name + '.extra')
+
+        print("%d reactions x %d time points (%.1f MB)" % (num_rxns, num_tp, os.path.getsize(in_file_name) / 1e6))
+        for name in ('read_data', 'read_data_bulk'):
+            func = getattr(triplicate_aa_plot, name)
+            best = min(timeit.repeat(lambda: func(in_file_name), number=1, repeat=3))
+            print("%-15s %.3f s" % (name, best))
+    finally:
+        os.remove(in_file_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+Benchmark suite of the aminoacylation assay pipeline on synthetic data.
+Every stage (parsing, concentration conversion, fitting, plotting) is timed for
+each size and the results are written as a json report that can be compared
+with the report of another commit.
+Usage:
+    benchmark_assay.py --sizes 100x8,1000x8,10000x20 --output report.json
+    benchmark_assay.py --compare base.json --output new.json
+"""
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import triplicate_aa_plot
+
+STAGES = ('read_data', 'read_data_bulk', 'calc_conc', 'calc_conc_set', 'fit', 'fit_batch', 'plot_multiple_fit')
+
+
+def write_assay_file(out_file_name, num_rxns, num_tp, noise=0.03, plateau=(0.5, 5.0), rate=(0.02, 1.5),
+                     t_max=30.0, sa=10000.0, aa_conc=10.0, background=100.0, seed=0):
+    """
+    :param out_file_name: output file name
+    :param num_rxns: number of conc/sa blocks
+    :param num_tp: number of time points per block
+    :param noise: relative gaussian noise of the counts
+    :param plateau: range of the plateau concentrations (uM) drawn uniformly
+    :param rate: range of the rates (1/min) drawn uniformly
+    :param t_max: last time point (min)
+    :param sa: CPM of the specific activity pad
+    :param aa_conc: concentration of the total amino acid
+    :param background: CPM at time 0
+    :param seed: seed of the random parameters and noise
+    :return: num_rxns x 2 array of the true plateau and rate
+    """
+    rng = np.random.default_rng(seed)
+    time_array = np.linspace(0, t_max, num_tp)
+    pars = np.column_stack((rng.uniform(plateau[0], plateau[1], num_rxns), rng.uniform(rate[0], rate[1], num_rxns)))
+    conc_matrix = triplicate_aa_plot.fitfunc(time_array, pars[:, :1], pars[:, 1:])
+    cpm_matrix = background + conc_matrix * sa / aa_conc * (1 + noise * rng.standard_normal(conc_matrix.shape))
+    cpm_matrix[:, 0] = background
+
+    block_format = "conc %g\n" % aa_conc + "%.2f %.1f\n" * num_tp + "sa %g\n" % sa
+    rows = np.empty((num_tp, 2))
+    rows[:, 0] = time_array
+    with open(out_file_name, 'w') as ofile:
+        for cpm_array in cpm_matrix:
+            rows[:, 1] = cpm_array
+            ofile.write(block_format % tuple(rows.ravel().tolist()))
+    return pars
+
+
+def parse_sizes(text):
+    """
+    :param text: comma-separated list of REACTIONSxTIMEPOINTS, e.g. "100x8,1000x20"
+    :return: list of (reactions, time points)
+    """
+    sizes = []
+    for size in text.split(','):
+        num_rxns, num_tp = size.lower().split('x')
+        sizes.append((int(num_rxns), int(num_tp)))
+    return sizes
+
+
+def best_time(func, setup, repeat):
+    """
+    :param func: function of the value returned by setup
+    :param setup: function preparing the input of func, not timed
+    :param repeat: number of runs
+    :return: the shortest wall time of the runs in seconds
+    A first, untimed run loads the lazily imported modules of the stage.
+    """
+    func(setup())
+    times = []
+    for i in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_size(in_file_name, out_dir, stages, repeat):
+    """
+    :return: dict of the best time of each stage on in_file_name
+    """
+    t = triplicate_aa_plot
+
+    def reactions():
+        return t.read_data_bulk(in_file_name)
+
+    def converted_reactions():
+        rxns = t.read_data_bulk(in_file_name)
+        for rxn in rxns:
+            rxn.calc_conc()
+        # refit from scratch every run
+        t.fit_cache.clear()
+        return rxns
+
+    def converted_set():
+        rxns = t.ReactionSet.from_columns(t.parse_columns(in_file_name))
+        rxns.calc_conc()
+        return rxns
+
+    def loop_calc_conc(rxns):
+        for rxn in rxns:
+            rxn.calc_conc()
+
+    def loop_fit(rxns):
+        for rxn in rxns:
+            t.fit(rxn.conc_array, rxn.time_array)
+
+    def plot(rxns):
+        t.fit_cache.clear()
+        t.plot_multiple_fit(rxns, os.path.join(out_dir, 'bench'))
+
+    runs = {
+        'read_data': (t.read_data, lambda: in_file_name),
+        'read_data_bulk': (t.read_data_bulk, lambda: in_file_name),
+        'calc_conc': (loop_calc_conc, reactions),
+        'calc_conc_set': (lambda rxns: rxns.calc_conc(), converted_set),
+        'fit': (loop_fit, converted_reactions),
+        'fit_batch': (lambda rxns: t.fit_batch(rxns.conc_matrix, rxns.time_matrix), converted_set),
+        'plot_multiple_fit': (plot, converted_set),
+    }
+    return dict((stage, best_time(runs[stage][0], runs[stage][1], repeat)) for stage in stages)
+
+
+def environment():
+    """
+    :return: dict describing the machine and the code being measured
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=here, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(report, base, ofile=sys.stdout):
+    """
+    :param report: new report
+    :param base: report to compare against
+    :param ofile: where to write the table
+    :return:
+    """
+    base_times = dict(((r['stage'], r['rxns'], r['tp']), r['seconds']) for r in base['results'])
+    ofile.write("%-18s %8s %6s %12s %12s %8s\n" % ("Stage", "Rxns", "Tp", "base s", "new s", "speedup"))
+    for r in report['results']:
+        base_seconds = base_times.get((r['stage'], r['rxns'], r['tp']))
+        if base_seconds is None:
+            continue
+        ofile.write("%-18s %8d %6d %12.4f %12.4f %7.2fx\n" % (r['stage'], r['rxns'], r['tp'], base_seconds,
+                                                              r['seconds'], base_seconds / max(r['seconds'], 1e-12)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the assay pipeline on synthetic data")
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes('10x8,100x8,1000x8,1000x50'),
+                        help="comma-separated REACTIONSxTIMEPOINTS (default: 10x8,100x8,1000x8,1000x50)")
+    parser.add_argument('--stages', default=','.join(STAGES), help="comma-separated stages to time")
+    parser.add_argument('--noise', type=float, default=0.03, help="relative noise of the counts")
+    parser.add_argument('--plateau', type=float, nargs=2, default=(0.5, 5.0), help="range of the plateaus (uM)")
+    parser.add_argument('--rate', type=float, nargs=2, default=(0.02, 1.5), help="range of the rates (1/min)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage, the best one is reported")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument('--output', default=None, help="json report to write")
+    parser.add_argument('--compare', metavar='REPORT', default=None, help="json report to compare against")
+    args = parser.parse_args()
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error("unknown stages: %s" % ", ".join(sorted(unknown)))
+
+    report = {'environment': environment(), 'noise': args.noise, 'plateau': list(args.plateau),
+              'rate': list(args.rate), 'seed': args.seed, 'results': []}
+    work_dir = tempfile.mkdtemp()
+    try:
+        for num_rxns, num_tp in args.sizes:
+            in_file_name = os.path.join(work_dir, "%dx%d.dat" % (num_rxns, num_tp))
+            write_assay_file(in_file_name, num_rxns, num_tp, args.noise, args.plateau, args.rate, seed=args.seed)
+            for stage, seconds in bench_size(in_file_name, work_dir, stages, args.repeat).items():
+                report['results'].append({'stage': stage, 'rxns': num_rxns, 'tp': num_tp, 'seconds': seconds})
+                print("%-18s %8d %6d %12.4f" % (stage, num_rxns, num_tp, seconds))
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.output is not None:
+        with open(args.output, 'w') as ofile:
+            json.dump(report, ofile, indent=1)
+    if args.compare is not None:
+        with open(args.compare, 'r') as ifile:
+            compare(report, json.load(ifile))
+
+
+if __name__ == "__main__":
+    main()
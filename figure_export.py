@@ -0,0 +1,72 @@
+"""
+Shared figure helpers of the plotting scripts: a headless pyplot and an export
+stage that writes one figure in several formats and then releases it.
+"""
+import sys
+import io
+import concurrent.futures
+
+DEFAULT_FORMATS = ('eps', 'svg')
+RASTER_FORMATS = ('png',)  # formats taken straight from the Agg canvas
+
+
+def pyplot():
+    """
+    :return: matplotlib.pyplot, on the non-interactive Agg backend unless pyplot was already set up
+    """
+    if 'matplotlib.pyplot' not in sys.modules:
+        import matplotlib
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def parse_formats(text):
+    """
+    :param text: comma-separated list of formats, e.g. "eps,svg,png"
+    :return: tuple of lower-case format names
+    """
+    return tuple(fmt.strip().lower().lstrip('.') for fmt in text.split(',') if fmt.strip())
+
+
+def _write(file_name, data):
+    with open(file_name, 'wb') as ofile:
+        ofile.write(data)
+    return file_name
+
+
+def export_figure(fig, fig_prefix, formats=DEFAULT_FORMATS, threads=False, close=True):
+    """
+    :param fig: matplotlib figure
+    :param fig_prefix: output figure prefix, the format is appended as extension
+    :param formats: formats to write, any of eps, svg, svgz (gzip-compressed svg), pdf, png, ...
+    :param threads: whether to write the files concurrently in threads
+    :param close: whether to release the figure afterwards
+    :return: list of the written file names
+    When a raster format is asked for, the figure is drawn once on the Agg
+    canvas and the raster formats are written from that buffer without drawing
+    again.  Each vector format is
+    rendered once into memory (serially, a figure is not thread-safe), and the
+    files are then written, optionally in parallel threads.
+    """
+    plt = pyplot()
+    try:
+        if set(RASTER_FORMATS).intersection(formats):
+            fig.canvas.draw()
+        outputs = []
+        for fmt in formats:
+            buf = io.BytesIO()
+            if fmt in RASTER_FORMATS:
+                import matplotlib.image
+                matplotlib.image.imsave(buf, fig.canvas.buffer_rgba(), format=fmt, dpi=fig.dpi)
+            else:
+                fig.savefig(buf, format=fmt)
+            outputs.append((fig_prefix + '.' + fmt, buf.getvalue()))
+    finally:
+        if close:
+            plt.close(fig)
+
+    if threads and len(outputs) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+            return list(executor.map(lambda output: _write(*output), outputs))
+    return [_write(file_name, data) for file_name, data in outputs]
@@ -0,0 +1,220 @@
+"""
+Import of raw 96 and 384-well plate reader exports.  A layout map assigns the
+wells to conditions, replicates and time points once, and every plate of a stack
+is then turned into the arrays the analysis scripts consume with index arrays,
+without a Python object per well.
+
+A plate export holds one or more plates, each as rows of numbers (one number per
+column of the plate), optionally preceded by the row letter.  Any other line
+(plate titles, column numbers, blank lines) separates the plates.  Empty cells
+are read as nan.
+
+The layout map is a table with a header line naming its columns:
+well,condition,replicate,time,conc,sa
+A1,R1,1,5,,
+...
+where well and condition are required, time defaults to 0 and replicate to the
+order of the wells within their condition and time point.  conc and sa are only
+needed for aminoacylation assays.  Wells missing from the map are ignored.
+"""
+import re
+import numpy as np
+from assay_io import DELIMITERS
+
+
+PLATE_SHAPES = {96: (8, 12), 384: (16, 24)}  # rows and columns of each plate size
+WELL_PATTERN = re.compile(r'^([A-Pa-p])0*([1-9][0-9]?)$')
+
+
+def _split(line):
+    # split a line on the first delimiter it contains, on whitespace otherwise
+    delimiter = next((d for d in DELIMITERS if d in line), None)
+    if delimiter is None:
+        return line.split()
+    return [token.strip() for token in line.rstrip('\r\n').split(delimiter)]
+
+
+def parse_wells(wells):
+    """
+    :param wells: list of well names such as A1 or P24
+    :return: arrays of the 0-based row and column of each well
+    """
+    rows, cols = [], []
+    for well in wells:
+        match = WELL_PATTERN.match(well)
+        if match is None:
+            raise ValueError("%s is not a well name" % well)
+        rows.append(ord(match.group(1).upper()) - ord('A'))
+        cols.append(int(match.group(2)) - 1)
+    return np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+
+def iter_plates(in_file_name, size=96):
+    """
+    :param in_file_name: plate reader export
+    :param size: number of wells of the plates, a key of PLATE_SHAPES
+    :return: generator of the plates in file order, each as a flat array of its
+    wells in row-major order (A1, A2, ..., B1, ...)
+    """
+    num_rows, num_cols = PLATE_SHAPES[size]
+    column_numbers = [str(col + 1) for col in range(num_cols)]
+    rows = []
+    with open(in_file_name, 'r') as ifile:
+        for line in ifile:
+            tokens = _split(line)
+            if tokens and tokens[0].upper() == chr(ord('A') + len(rows)):
+                tokens = tokens[1:]
+            if len(tokens) == num_cols + 1 and not tokens[-1]:
+                # a delimiter at the end of the row
+                tokens = tokens[:-1]
+            values = None
+            if len(tokens) == num_cols and not (not rows and tokens == column_numbers):
+                try:
+                    values = np.array([token or 'nan' for token in tokens], dtype=float)
+                except ValueError:
+                    pass
+            if values is None:
+                if rows:
+                    raise ValueError("%s has a plate with %d rows instead of %d" % (in_file_name, len(rows), num_rows))
+                continue
+            rows.append(values)
+            if len(rows) == num_rows:
+                yield np.concatenate(rows)
+                rows = []
+    if rows:
+        raise ValueError("%s ends with a plate of %d rows instead of %d" % (in_file_name, len(rows), num_rows))
+
+
+def read_plates(in_file_name, size=96):
+    """
+    :param in_file_name: plate reader export
+    :param size: number of wells of the plates, a key of PLATE_SHAPES
+    :return: plates x wells array of the whole stack
+    """
+    plates = list(iter_plates(in_file_name, size))
+    if not plates:
+        raise ValueError("%s has no %d-well plates" % (in_file_name, size))
+    return np.stack(plates)
+
+
+class PlateLayout:
+    """
+    Assignment of the wells of a plate to conditions, replicates and time points,
+    as one array entry per mapped well.
+    """
+    def __init__(self, wells, conditions, replicates=None, times=None, conc=None, sa=None, size=None):
+        """
+        :param wells: list of well names
+        :param conditions: condition label of each well
+        :param replicates: replicate label of each well, defaults to the order of the
+        wells within their condition and time point
+        :param times: time point of each well, defaults to 0
+        :param conc: amino acid concentration of each well, needed by reaction_columns
+        :param sa: specific activity of each well, needed by reaction_columns
+        :param size: number of wells of the plate, defaults to the smallest plate
+        holding all the wells
+        """
+        rows, cols = parse_wells(wells)
+        if size is None:
+            size = 96 if np.all(rows < 8) and np.all(cols < 12) else 384
+        num_rows, num_cols = PLATE_SHAPES[size]
+        if np.any(rows >= num_rows) or np.any(cols >= num_cols):
+            raise ValueError("the layout has wells outside of a %d-well plate" % size)
+        self.size = size
+        self.well = rows * num_cols + cols
+        if len(np.unique(self.well)) != len(self.well):
+            raise ValueError("the layout maps a well more than once")
+        num_wells = len(self.well)
+
+        # conditions and replicates keep the order of their first appearance
+        labels, first, self.condition = np.unique(np.asarray(conditions, dtype=str), return_index=True,
+                                                  return_inverse=True)
+        rank = np.argsort(np.argsort(first))
+        self.conditions = labels[np.argsort(first)].tolist()
+        self.condition = rank[self.condition]
+        self.time = np.zeros(num_wells) if times is None else np.asarray(times, dtype=float)
+        if replicates is None:
+            # number the wells of each condition and time point in layout order
+            key = np.lexsort((np.arange(num_wells), self.time, self.condition))
+            start = np.ones(num_wells, dtype=bool)
+            start[1:] = (np.diff(self.condition[key]) != 0) | (np.diff(self.time[key]) != 0)
+            group_start = np.maximum.accumulate(np.where(start, np.arange(num_wells), 0))
+            self.replicate = np.empty(num_wells, dtype=int)
+            self.replicate[key] = np.arange(num_wells) - group_start
+        else:
+            labels, first, replicate = np.unique(np.asarray(replicates, dtype=str), return_index=True,
+                                                 return_inverse=True)
+            self.replicate = np.argsort(np.argsort(first))[replicate]
+        self.conc = np.full(num_wells, np.nan) if conc is None else np.asarray(conc, dtype=float)
+        self.sa = np.full(num_wells, np.nan) if sa is None else np.asarray(sa, dtype=float)
+
+    @classmethod
+    def from_file(cls, layout_file_name, size=None):
+        """
+        :param layout_file_name: layout map, see the module documentation
+        :param size: number of wells of the plate, see __init__
+        :return: a PlateLayout
+        """
+        with open(layout_file_name, 'r') as ifile:
+            lines = [_split(line) for line in ifile if line.strip() and not line.startswith('#')]
+        if not lines:
+            raise ValueError("%s is empty" % layout_file_name)
+        header = [name.lower() for name in lines[0]]
+        for name in ('well', 'condition'):
+            if name not in header:
+                raise ValueError("%s has no %s column" % (layout_file_name, name))
+        table = dict((name, [row[i] if i < len(row) else '' for row in lines[1:]]) for i, name in enumerate(header))
+
+        def numbers(name):
+            if name not in table:
+                return None
+            return np.array([value or 'nan' for value in table[name]], dtype=float)
+
+        return cls(table['well'], table['condition'], table.get('replicate'), numbers('time'), numbers('conc'),
+                   numbers('sa'), size)
+
+    def bar_matrix(self, plates):
+        """
+        :param plates: plates x wells array, see read_plates
+        :return: replicate x condition data of plot_bar, with the replicates of every
+        plate stacked and nan for missing wells, and its group and series labels
+        The groups are the conditions and the series the time points, and the columns
+        are ordered series by series.
+        """
+        plates = np.atleast_2d(plates)
+        times, series = np.unique(self.time, return_inverse=True)
+        num_groups = len(self.conditions)
+        num_reps = int(self.replicate.max()) + 1 if len(self.well) else 0
+        column = series * num_groups + self.condition
+        index = np.full((num_reps, len(times) * num_groups), plates.shape[1], dtype=int)
+        if len(np.unique(self.replicate * index.shape[1] + column)) != len(column):
+            raise ValueError("the layout maps a replicate of a condition and time point more than once")
+        index[self.replicate, column] = self.well
+        # the extra last column of nan stands in for the wells that are not mapped
+        padded = np.concatenate((plates, np.full((len(plates), 1), np.nan)), axis=1)
+        data = padded[:, index].reshape(-1, index.shape[1])
+        return data, list(self.conditions), ['%g min' % t for t in times]
+
+    def reaction_columns(self, plates):
+        """
+        :param plates: plates x wells array, see read_plates
+        :return: dict of the time, cpm, offsets, sa and conc columns of
+        triplicate_aa_plot, one reaction per plate, condition and replicate with its
+        wells ordered by time
+        """
+        plates = np.atleast_2d(plates)
+        order = np.lexsort((self.time, self.replicate, self.condition))
+        key = self.condition[order] * (int(self.replicate.max()) + 1) + self.replicate[order]
+        start = np.flatnonzero(np.concatenate(([True], np.diff(key) != 0)))
+        lengths = np.diff(np.append(start, len(order)))
+        first = order[start]
+        if np.any(np.isnan(self.conc[first])) or np.any(np.isnan(self.sa[first])):
+            raise ValueError("the layout needs conc and sa for every reaction")
+        num_plates = len(plates)
+        return {
+            'time': np.tile(self.time[order], num_plates),
+            'cpm': plates[:, self.well[order]].ravel(),
+            'offsets': np.concatenate(([0], np.cumsum(np.tile(lengths, num_plates)))).astype(np.int64),
+            'sa': np.tile(self.sa[first], num_plates),
+            'conc': np.tile(self.conc[first], num_plates),
+        }
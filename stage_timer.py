@@ -0,0 +1,106 @@
+"""
+Opt-in per-stage instrumentation of the analysis scripts.  Each stage records
+its wall time, CPU time, the largest resident memory of the process so far and
+any counts the stage reports, and is written as one json line.  A run can also
+be profiled with cProfile and tracemalloc, which adds the peak memory allocated
+within each stage.
+"""
+import os
+import sys
+import json
+import time
+import contextlib
+
+
+def _max_rss_kb():
+    # largest resident memory of this process since it started, None where resource is missing
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class StageRecorder:
+    """
+    Record the stages of runs to a json lines file.  Without a file name the
+    stages run untouched, so callers can always wrap their stages.  The recorder
+    only holds its settings, so it can be handed to worker processes; every
+    record is appended with a single write.
+    """
+    def __init__(self, out_file_name=None, profile_prefix=None):
+        self.out_file_name = out_file_name
+        self.profile_prefix = profile_prefix  # write <prefix>.<run>.prof and .mem.txt per run
+        self.run_name = None
+
+    @property
+    def enabled(self):
+        return self.out_file_name is not None
+
+    @contextlib.contextmanager
+    def run(self, name, profile_name=None):
+        """
+        Group the stages of one run, e.g. one input file, and profile it when profile_prefix is set.
+        The dumps are named after profile_name, by default the base name of name;
+        runs whose names share a base name need a profile_name each.
+        """
+        self.run_name = name
+        profiler = None
+        if self.profile_prefix is not None:
+            import cProfile
+            import tracemalloc
+            tracemalloc.start()
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            yield self
+        finally:
+            self.run_name = None
+            if profiler is not None:
+                profiler.disable()
+                prefix = "%s.%s" % (self.profile_prefix, profile_name or os.path.basename(str(name)))
+                profiler.dump_stats(prefix + '.prof')
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                with open(prefix + '.mem.txt', 'w') as ofile:
+                    for stat in snapshot.statistics('lineno')[:50]:
+                        ofile.write("%s\n" % stat)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block.  The yielded dict takes counts of the stage,
+        e.g. reactions fitted or bytes written, that go into its record.
+        max_rss_so_far_kb is cumulative: a stage after a heavier one reports the
+        heavier one.  The memory of the stage itself is peak_traced_kb, recorded
+        when tracemalloc runs (see profile_prefix).
+        """
+        counts = {}
+        if not self.enabled:
+            yield counts
+            return
+        tracemalloc = sys.modules.get('tracemalloc')
+        tracing = tracemalloc is not None and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield counts
+        finally:
+            record = {'run': self.run_name, 'stage': name, 'pid': os.getpid(),
+                      'wall_s': time.perf_counter() - wall, 'cpu_s': time.process_time() - cpu,
+                      'max_rss_so_far_kb': _max_rss_kb()}
+            if tracing:
+                record['peak_traced_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            record.update(counts)
+            with open(self.out_file_name, 'a') as ofile:
+                ofile.write(json.dumps(record) + "\n")
+
+
+def file_bytes(file_names):
+    """
+    :return: total size of the files in bytes
+    """
+    return sum(os.path.getsize(file_name) for file_name in file_names)
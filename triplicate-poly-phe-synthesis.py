@@ -1,25 +1,93 @@
 #!/usr/bin/env python
-import sys 
+import os
+import argparse
 import numpy as np
-import scipy.optimize
-import scipy.stats
-import matplotlib.pyplot as plt
+from figure_export import pyplot, export_figure, parse_formats, DEFAULT_FORMATS
+from stage_timer import StageRecorder, file_bytes
+from assay_io import load_matrix, load_counters
+from plate_io import PLATE_SHAPES, PlateLayout, read_plates
+# matplotlib is imported in plot_bar, so that loading this script stays cheap
 
 
-def plot_bar(data, fig_prefix):
+DEFAULT_SERIES_LABELS = ('5 min', '20 min')
+DEFAULT_SERIES_COLORS = ('lightgrey', 'darkgrey')
+
+
+def read_layout_header(in_file_name):
+    """
+    :param in_file_name: input file name
+    :return: dict with the 'groups' and/or 'series' labels found in the header
+    The optional header is made of comment lines before the data, e.g.
+    # groups: R1, R2, R3, R4, R5, R6
+    # series: 5 min, 20 min
+    Columns are ordered series by series: all groups of the first series, then
+    all groups of the second one, and so on.
+    """
+    layout = {}
+    with open(in_file_name, 'r') as ifile:
+        for line in ifile:
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith('#'):
+                break
+            key, sep, value = line[1:].partition(':')
+            key = key.strip().lower()
+            if sep and key in ('groups', 'series'):
+                layout[key] = [label.strip() for label in value.split(',') if label.strip()]
+    return layout
+
+
+def bar_layout(n_col, groups=None, series=None, n_series=None):
+    """
+    :param n_col: number of data columns
+    :param groups: group labels, defaults to R1, R2, ...
+    :param series: series labels, defaults to 5 min and 20 min for two series
+    :param n_series: number of series when no labels are given, defaults to 2
+    :return: the group labels and the series labels
+    """
+    if series is None:
+        if n_series is None:
+            n_series = n_col // len(groups) if groups else 2
+        series = list(DEFAULT_SERIES_LABELS) if n_series == 2 else ['S%d' % (i + 1) for i in range(n_series)]
+    if groups is None:
+        groups = ['R%d' % (i + 1) for i in range(n_col // max(len(series), 1))]
+    if len(groups) * len(series) != n_col:
+        raise ValueError("%d columns do not make %d groups x %d series" % (n_col, len(groups), len(series)))
+    return list(groups), list(series)
+
+
+def plot_bar(data, fig_prefix, formats=DEFAULT_FORMATS, threads=False, groups=None, series=None, n_series=None,
+             ylim=(-0.1, 4)):
     """
     Plot the data as a grouped bar graph
-    :param data: input data
+    :param data: input data, one row per replicate and one column per group and
+    series, ordered series by series
     :param fig_prefix: output figure prefix
-    :return:
+    :param formats: figure formats to write, see export_figure
+    :param threads: whether to write the formats concurrently
+    :param groups: group labels, see bar_layout
+    :param series: series labels, see bar_layout
+    :param n_series: number of series when no labels are given
+    :param ylim: y-axis limits, None to fit the data
+    :return: list of the written file names
+    All bars go into one PolyCollection and all error bars into one
+    LineCollection, so drawing does not slow down with the number of bars.
     """
+    plt = pyplot()
+    from matplotlib.collections import PolyCollection, LineCollection
+    from matplotlib.patches import Patch
+
+    data = np.atleast_2d(data)
     n_row, n_col = np.shape(data)
-    ind = np.arange(n_col/2)
-    w = 0.35
+    groups, series = bar_layout(n_col, groups, series, n_series)
+    n_groups, n_series = len(groups), len(series)
+    ind = np.arange(n_groups)
+    w = 0.7 / n_series
 
-    # Calculate the mean and stdev of the data
-    mean_data = np.average(data, axis=0)
-    stdev_data = np.std(data, axis=0)
+    # Calculate the mean and stdev of the data, as a series x group matrix, skipping missing replicates
+    mean_data = np.nanmean(data, axis=0).reshape(n_series, n_groups)
+    stdev_data = np.nanstd(data, axis=0).reshape(n_series, n_groups)
 
     # plot
     fig = plt.figure(figsize=(4, 4))
@@ -28,38 +96,195 @@ def plot_bar(data, fig_prefix):
     rect_scatter = [left, bottom, width, height]
     ax = plt.axes(rect_scatter)
 
-    rects1 = ax.bar(ind, mean_data[0:6], w, color="lightgrey", yerr=stdev_data[0:6], ecolor='k')
-    rects2 = ax.bar(ind+w, mean_data[6:12], w, color="darkgrey", yerr=stdev_data[6:12], ecolor='k')
+    # centers of all bars, then their corners and error bar segments in one go
+    x = (ind[None, :] + w * np.arange(n_series)[:, None]).ravel()
+    y = mean_data.ravel()
+    err = stdev_data.ravel()
+    x0, x1 = x - w / 2, x + w / 2
+    zero = np.zeros_like(y)
+    verts = np.stack((np.column_stack((x0, zero)), np.column_stack((x0, y)),
+                      np.column_stack((x1, y)), np.column_stack((x1, zero))), axis=1)
+    if n_series == len(DEFAULT_SERIES_COLORS):
+        colors = list(DEFAULT_SERIES_COLORS)
+    else:
+        colors = [str(level) for level in np.linspace(0.85, 0.35, n_series)]
+    bar_colors = np.repeat(colors, n_groups)
+    ax.add_collection(PolyCollection(verts, facecolors=bar_colors, edgecolors='none'))
+    segments = np.stack((np.column_stack((x, y - err)), np.column_stack((x, y + err))), axis=1)
+    ax.add_collection(LineCollection(segments, colors='k'))
 
     # add some text for labels, title and axes ticks
     ax.set_ylabel('Polymerized Phe (pmol)')
-    ax.set_ylim(-0.1, 4)
-    ax.set_xticks(ind + w / 2)
-    ax.set_xticklabels(('R1', 'R2', 'R3', 'R4', 'R5', 'R6'))
+    ax.set_xlim(x0.min() - w, x1.max() + w)
+    if ylim is None:
+        ax.set_ylim(min(0, np.amin(y - err)), np.amax(y + err) * 1.1)
+    else:
+        ax.set_ylim(*ylim)
+    ax.set_xticks(ind + w * (n_series - 1) / 2)
+    ax.set_xticklabels(groups)
+
+    ax.legend([Patch(color=color) for color in colors], series, loc='upper left')
+
+    return export_figure(fig, fig_prefix, formats, threads)
+
+
+def condition_statistics(data, confidence=0.95):
+    """
+    :param data: replicate x condition array, nan marks a missing replicate
+    :param confidence: level of the confidence intervals of the means
+    :return: structured array of one record per condition with the fields n,
+    mean, sd, sem, ci_low and ci_high
+    The standard deviation is the sample one (ddof=1), so conditions with fewer
+    than two replicates get nan for everything but their mean.
+    """
+    import scipy.stats
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    dtype = np.dtype([('n', int), ('mean', float), ('sd', float), ('sem', float),
+                      ('ci_low', float), ('ci_high', float)])
+    stats = np.zeros(data.shape[1], dtype=dtype)
+
+    mask = np.isfinite(data)
+    n = np.sum(mask, axis=0)
+    with np.errstate(all='ignore'):
+        mean = np.sum(np.where(mask, data, 0), axis=0) / n
+        sd = np.sqrt(np.sum(np.where(mask, data - mean, 0)**2, axis=0) / (n - 1))
+        sem = sd / np.sqrt(n)
+        t_value = scipy.stats.t.ppf(0.5 + confidence / 2, np.where(n > 1, n - 1, np.nan))
+    stats['n'] = n
+    stats['mean'] = mean
+    stats['sd'] = sd
+    stats['sem'] = sem
+    stats['ci_low'] = mean - t_value * sem
+    stats['ci_high'] = mean + t_value * sem
+    return stats
+
 
-    ax.legend((rects1[0], rects2[0]), ('5 min', '20 min'), loc='upper left')
+def welch_tests(stats):
+    """
+    :param stats: output of condition_statistics
+    :return: structured array of one record per pair of conditions a < b with the
+    fields a, b, diff (mean of b minus mean of a), t, df and p (two-sided)
+    Welch's unequal variance t-test of every pair of conditions at once.
+    """
+    import scipy.stats
+    a, b = np.triu_indices(len(stats), k=1)
+    dtype = np.dtype([('a', int), ('b', int), ('diff', float), ('t', float), ('df', float), ('p', float)])
+    tests = np.zeros(len(a), dtype=dtype)
 
-    fig.savefig(fig_prefix + '.eps')
-    fig.savefig(fig_prefix + '.svg')
+    var_n = stats['sem']**2
+    with np.errstate(all='ignore'):
+        diff = stats['mean'][b] - stats['mean'][a]
+        se2 = var_n[a] + var_n[b]
+        t = diff / np.sqrt(se2)
+        # Welch-Satterthwaite degrees of freedom
+        df = se2**2 / (var_n[a]**2 / (stats['n'][a] - 1) + var_n[b]**2 / (stats['n'][b] - 1))
+    tests['a'] = a
+    tests['b'] = b
+    tests['diff'] = diff
+    tests['t'] = t
+    tests['df'] = df
+    tests['p'] = 2 * scipy.stats.t.sf(np.abs(t), df)
+    return tests
 
 
-def main():
+def print_statistics(stats, tests, labels, out_file_prefix):
+    """
+    :param stats: output of condition_statistics
+    :param tests: output of welch_tests
+    :param labels: one label per condition
+    :param out_file_prefix: output file prefix
+    :return: list of the written file names
+    Tab-separated tables of the conditions in -stats.dat and of the pairwise tests
+    in -welch.dat, each formatted in one go.
+    """
+    labels = np.asarray(labels, dtype=object)
+    stats_file_name = out_file_prefix + "-stats.dat"
+    with open(stats_file_name, 'w') as ofile:
+        ofile.write("Condition\tn\tmean\tSD\tSEM\tCI low\tCI high\n")
+        rows = zip(labels.tolist(), *(stats[field].tolist() for field in stats.dtype.names))
+        ofile.write("".join("%s\t%d\t%.4g\t%.4g\t%.4g\t%.4g\t%.4g\n" % row for row in rows))
+    welch_file_name = out_file_prefix + "-welch.dat"
+    with open(welch_file_name, 'w') as ofile:
+        ofile.write("A\tB\tB-A\tt\tdf\tp\n")
+        rows = zip(labels[tests['a']].tolist(), labels[tests['b']].tolist(),
+                   *(tests[field].tolist() for field in ('diff', 't', 'df', 'p')))
+        ofile.write("".join("%s\t%s\t%.4g\t%.4g\t%.4g\t%.3E\n" % row for row in rows))
+    return [stats_file_name, welch_file_name]
+
+
+def build_parser():
     # Read variables from the command line
-    try:
-        in_file_name = sys.argv[1]
-        out_file_prefix = sys.argv[2]
-    except IOError:
-        print("Usage: ", sys.argv[0], "input file, output file prefix")
-        sys.exit(1)
-
-    # read the data
-    # The input file has the following format:
-    # Run 1 5 min Run 1 20 min
-    # Run 2 5 min Run 2 20 min
-    # ...
-    data = np.loadtxt(in_file_name)
-
-    plot_bar(data, out_file_prefix)
+    parser = argparse.ArgumentParser(description="Plot triplicated poly phenylalanine synthesis assays")
+    parser.add_argument('in_file_name', help="input file, or a plate reader export with --layout")
+    parser.add_argument('out_file_prefix', help="output file prefix")
+    parser.add_argument('--formats', type=parse_formats, default=DEFAULT_FORMATS,
+                        help="comma-separated figure formats among eps, svg, svgz, pdf, png (default: eps,svg)")
+    parser.add_argument('--series', metavar='N', type=int, default=None,
+                        help="number of series (time points) when the file has no header (default: 2)")
+    parser.add_argument('--layout', metavar='FILE', default=None,
+                        help="read the input as a stack of raw plates, with the wells assigned to conditions "
+                             "and time points by the layout map FILE (see plate_io)")
+    parser.add_argument('--plate', type=int, choices=sorted(PLATE_SHAPES), default=None,
+                        help="plate size of --layout (default: guessed from the wells of the layout)")
+    parser.add_argument('--table', action='store_true',
+                        help="write mean, SD, SEM and CI of every condition and Welch t-tests of every pair "
+                             "of conditions to out_file_prefix-stats.dat and -welch.dat")
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help="level of the confidence intervals of --table (default: 0.95)")
+    parser.add_argument('--stats', metavar='FILE', default=None,
+                        help="append wall/CPU time, memory and counts of every stage to FILE as json lines")
+    parser.add_argument('--profile', metavar='PREFIX', default=None,
+                        help="write cProfile and tracemalloc dumps of the run to PREFIX.<file>.*")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    in_file_name = args.in_file_name
+    out_file_prefix = args.out_file_prefix
+    recorder = StageRecorder(args.stats, args.profile)
+
+    with recorder.run(in_file_name):
+        # read the data
+        # The input file has the following format, one row per replicate and the
+        # columns ordered series by series, with an optional header (see read_layout_header):
+        # R1 5 min ... R6 5 min R1 20 min ... R6 20 min
+        # ...
+        # Columns may be separated by whitespace, commas, tabs or semicolons, and the
+        # parsed matrix is cached next to the input file (see assay_io.load_matrix).
+        with recorder.stage('load') as counts:
+            if args.layout is None:
+                layout = read_layout_header(in_file_name)
+                hits = load_counters['hits']
+                data = load_matrix(in_file_name)
+                counts['cache_hit'] = load_counters['hits'] > hits
+            else:
+                plate_layout = PlateLayout.from_file(args.layout, args.plate)
+                plates = read_plates(in_file_name, plate_layout.size)
+                data, groups, series = plate_layout.bar_matrix(plates)
+                layout = {'groups': groups, 'series': series}
+                counts['plates'] = len(plates)
+                counts['cache_hit'] = False
+            # a cache hit memory-maps the matrix and parses nothing
+            counts['bytes_parsed'] = 0 if counts['cache_hit'] else os.path.getsize(in_file_name)
+            counts['values'] = int(np.size(data))
+
+        if args.table:
+            with recorder.stage('statistics') as counts:
+                groups, series = bar_layout(np.shape(data)[1], layout.get('groups'), layout.get('series'),
+                                            args.series)
+                stats = condition_statistics(data, args.confidence)
+                tests = welch_tests(stats)
+                labels = ["%s %s" % (group, label) for label in series for group in groups]
+                counts['conditions'] = len(stats)
+                counts['pairs'] = len(tests)
+                counts['bytes_written'] = file_bytes(print_statistics(stats, tests, labels, out_file_prefix))
+
+        with recorder.stage('plot') as counts:
+            file_names = plot_bar(data, out_file_prefix, args.formats, groups=layout.get('groups'),
+                                  series=layout.get('series'), n_series=args.series)
+            counts['bytes_written'] = file_bytes(file_names)
 
 
 if __name__ == "__main__":
@@ -1,30 +1,439 @@
 #!/usr/bin/env python
 import sys
+import os
+import glob
+import argparse
+import concurrent.futures
+from multiprocessing import shared_memory
+import json
+import collections
+import inspect
+import hashlib
+import time
 import numpy as np
-import scipy.optimize
-import scipy.stats
-import matplotlib.pyplot as plt
+from assay_io import parse_floats, save_arrays, load_arrays, load_cached, load_counters
+from figure_export import pyplot, export_figure, parse_formats, DEFAULT_FORMATS
+from stage_timer import StageRecorder, file_bytes
+from plate_io import PLATE_SHAPES, PlateLayout, read_plates
+# scipy and matplotlib are imported where they are used, so that a fit-only run
+# never pays for matplotlib and a bare import stays cheap
 
 
 def fitfunc(x, p0, p1):
     return p0 * (1 - np.exp(-p1*x))
 
 
+def fitjac(x, p0, p1):
+    # analytic Jacobian of fitfunc with respect to p0 and p1, one row per time point
+    e = np.exp(-p1*x)
+    return np.stack((1 - e, p0 * x * e), axis=-1)
+
+
+def initial_guess(conc_array, time_array):
+    """
+    :param conc_array: array of the product concentration, or M x N matrix of them
+    :param time_array: array of time, or M x N matrix of them
+    :return: starting parameters (2 values, or M x 2) estimated from the data
+    The plateau is taken from the mean of the last two points, and the rate from
+    the initial slope divided by the plateau.  When the data give no usable
+    estimate, the plateau falls back to 1 and the rate to 3 / max(time).
+    """
+    y = np.atleast_2d(np.asarray(conc_array, dtype=float))
+    t = np.broadcast_to(np.asarray(time_array, dtype=float), y.shape)
+    with np.errstate(all='ignore'):
+        plateau = np.mean(y[:, -2:], axis=1)
+        plateau = np.where(np.isfinite(plateau) & (plateau != 0), plateau, 1.0)
+        if y.shape[1] > 1:
+            slope = (y[:, 1] - y[:, 0]) / (t[:, 1] - t[:, 0])
+            rate = slope / plateau
+        else:
+            rate = np.full(len(y), np.nan)
+        t_max = np.amax(t, axis=1)
+        default_rate = np.where(t_max > 0, 3 / t_max, 1.0)
+        rate = np.where(np.isfinite(rate) & (rate > 0), rate, default_rate)
+    guess = np.stack((plateau, rate), axis=-1)
+    return guess[0] if np.ndim(conc_array) == 1 else guess
+
+
+class FitCache:
+    """
+    Memoize fit results by a hash of the (time, conc) arrays and the model.
+    Recent results are kept in memory, evicting the least recently used one when
+    more than max_entries are held; with disk_dir set, results are also stored
+    there as small json files that later runs can share.
+    """
+    version = 1  # bump when the fitting code changes, so old disk entries are ignored
+
+    def __init__(self, max_entries=4096, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, conc_array, time_array, model=fitfunc):
+        """
+        :return: hex digest identifying the model and the content of both arrays
+        """
+        sha1 = hashlib.sha1(("%s.%s:%d" % (model.__module__, model.__name__, self.version)).encode())
+        for array in (time_array, conc_array):
+            array = np.ascontiguousarray(array, dtype=float)
+            sha1.update(str(array.shape).encode())
+            sha1.update(array.tobytes())
+        return sha1.hexdigest()
+
+    def get(self, key):
+        """
+        :return: the cached (pars, r2) for key, or None
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            pars, r2 = self.entries[key]
+            return pars.copy(), r2
+        if self.disk_dir is not None:
+            try:
+                with open(os.path.join(self.disk_dir, key + '.json'), 'r') as ifile:
+                    entry = json.load(ifile)
+                pars, r2 = np.array(entry['pars']), entry['r2']
+                self.disk_hits += 1
+                self._remember(key, pars, r2)
+                return pars.copy(), r2
+            except (OSError, ValueError, KeyError):
+                pass
+        self.misses += 1
+        return None
+
+    def put(self, key, pars, r2):
+        self._remember(key, np.array(pars, dtype=float), float(r2))
+        if self.disk_dir is not None:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # write to a private file first, so concurrent runs never read half an entry
+            tmp_file_name = os.path.join(self.disk_dir, "%s.%d.tmp" % (key, os.getpid()))
+            with open(tmp_file_name, 'w') as ofile:
+                json.dump({'pars': [float(p) for p in pars], 'r2': float(r2)}, ofile)
+            os.replace(tmp_file_name, os.path.join(self.disk_dir, key + '.json'))
+
+    def _remember(self, key, pars, r2):
+        self.entries[key] = (pars, r2)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        """
+        :return: dict of the hit, disk hit, miss and eviction counts and the number of entries held
+        """
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.entries)}
+
+
+fit_cache = FitCache()  # used by fit(), see use_fit_cache_dir to share results across runs
+# fits done and model evaluations spent by fit() and fit_batch in this process;
+# fit_batch counts one evaluation per reaction and iteration
+fit_counters = collections.Counter()
+
+
+def use_fit_cache_dir(disk_dir):
+    """
+    :param disk_dir: directory of the on-disk tier of fit_cache, or None to keep it in memory only
+    :return:
+    """
+    fit_cache.disk_dir = disk_dir
+
+
 def fit(conc_array, time_array):
     """
     :param conc_array: array of the product concentration
     :param time_array: array of time
     :return: pars, the fitted rate and r2, the R2 of the fit
+    Results are memoized in fit_cache.
+    """
+    import scipy.optimize
+    key = fit_cache.key(conc_array, time_array)
+    cached = fit_cache.get(key)
+    if cached is None:
+        pars, pcov, info, mesg, ier = scipy.optimize.curve_fit(fitfunc, time_array, conc_array,
+                                                               p0=initial_guess(conc_array, time_array),
+                                                               jac=fitjac, full_output=True)
+        fit_counters['fits'] += 1
+        fit_counters['evaluations'] += info['nfev'] + info.get('njev', 0)
+
+        # Calculate r squared
+        fitted_data = fitfunc(time_array, pars[0], pars[1])
+        r2 = float(r_squared(fitted_data, conc_array))
+        fit_cache.put(key, pars, r2)
+    else:
+        pars, r2 = cached
+    return pars, r2
+
+
+def fit_batch(conc_matrix, time_matrix, p0=None, max_iter=200, tol=1e-10):
+    """
+    :param conc_matrix: M x N array of product concentrations, one reaction per row
+    :param time_matrix: M x N array of time, or a single array of N time points
+    :param p0: M x 2 array of starting parameters, defaults to initial_guess
+    :param max_iter: maximum number of Levenberg-Marquardt iterations
+    :param tol: relative tolerance on the residual sum of squares and on the step
+    :return: pars (M x 2), pcov (M x 2 x 2) and converged (M booleans)
+    Fit fitfunc to all reactions at once with Levenberg-Marquardt iterations done
+    as array operations.  Rows that do not converge are refitted one by one with
+    scipy.optimize.curve_fit; rows that fail there too get nan parameters and
+    converged set to False.
+    """
+    import scipy.optimize
+    y = np.atleast_2d(np.asarray(conc_matrix, dtype=float))
+    t = np.broadcast_to(np.asarray(time_matrix, dtype=float), y.shape)
+    num_rxns, num_tp = y.shape
+    pars = initial_guess(y, t) if p0 is None else np.array(p0, dtype=float).reshape(num_rxns, 2)
+
+    def residuals(a, k, rows):
+        return y[rows] - a[:, None] * (1 - np.exp(-k[:, None] * t[rows]))
+
+    rows = np.arange(num_rxns)
+    rss = np.sum(residuals(pars[:, 0], pars[:, 1], rows)**2, axis=1)
+    fit_counters['fits'] += num_rxns
+    fit_counters['evaluations'] += num_rxns
+    lam = np.full(num_rxns, 1e-3)
+    converged = np.zeros(num_rxns, dtype=bool)
+    stalled = np.zeros(num_rxns, dtype=bool)  # rows whose damping blew up, left to the fallback
+    with np.errstate(all='ignore'):
+        for it in range(max_iter):
+            rows = np.flatnonzero(~converged & ~stalled)
+            if len(rows) == 0:
+                break
+            fit_counters['evaluations'] += len(rows)
+            a, k = pars[rows, 0], pars[rows, 1]
+            e = np.exp(-k[:, None] * t[rows])
+            r = y[rows] - a[:, None] * (1 - e)
+            # Jacobian of the model with respect to p0 and p1
+            j1 = 1 - e
+            j2 = a[:, None] * t[rows] * e
+            s11, s12, s22 = np.sum(j1*j1, axis=1), np.sum(j1*j2, axis=1), np.sum(j2*j2, axis=1)
+            g1, g2 = np.sum(j1*r, axis=1), np.sum(j2*r, axis=1)
+
+            # solve the damped 2 x 2 normal equations of every row
+            a11, a22 = s11 * (1 + lam[rows]), s22 * (1 + lam[rows])
+            det = a11*a22 - s12*s12
+            d1 = (a22*g1 - s12*g2) / det
+            d2 = (a11*g2 - s12*g1) / det
+            new_a, new_k = a + d1, k + d2
+            new_rss = np.sum(residuals(new_a, new_k, rows)**2, axis=1)
+
+            accept = np.isfinite(new_rss) & (new_rss <= rss[rows])
+            done = accept & ((rss[rows] - new_rss <= tol * rss[rows]) |
+                             ((np.abs(d1) <= tol * (np.abs(a) + tol)) & (np.abs(d2) <= tol * (np.abs(k) + tol))))
+            acc = rows[accept]
+            pars[acc, 0], pars[acc, 1] = new_a[accept], new_k[accept]
+            rss[acc] = new_rss[accept]
+            lam[acc] /= 10
+            lam[rows[~accept]] *= 10
+            converged[rows[done]] = True
+            stalled[rows[~done & (lam[rows] > 1e16)]] = True
+
+    # covariance scaled by the residual variance, as curve_fit does by default
+    pcov = np.empty((num_rxns, 2, 2))
+    with np.errstate(all='ignore'):
+        e = np.exp(-pars[:, 1:] * t)
+        j1, j2 = 1 - e, pars[:, :1] * t * e
+        s11, s12, s22 = np.sum(j1*j1, axis=1), np.sum(j1*j2, axis=1), np.sum(j2*j2, axis=1)
+        scale = rss / (num_tp - 2) / (s11*s22 - s12*s12)
+        pcov[:, 0, 0], pcov[:, 1, 1] = s22 * scale, s11 * scale
+        pcov[:, 0, 1] = pcov[:, 1, 0] = -s12 * scale
+
+    # fall back to the per-reaction path for the rows that did not converge
+    for i in np.flatnonzero(~converged):
+        try:
+            pars[i], pcov[i], info, mesg, ier = scipy.optimize.curve_fit(fitfunc, t[i], y[i],
+                                                                         p0=initial_guess(y[i], t[i]),
+                                                                         jac=fitjac, full_output=True)
+            fit_counters['evaluations'] += info['nfev'] + info.get('njev', 0)
+            converged[i] = True
+        except (RuntimeError, ValueError):
+            pars[i] = np.nan
+            pcov[i] = np.nan
+    return pars, pcov, converged
+
+
+def r_squared(fitted_matrix, observed_matrix):
+    """
+    :param fitted_matrix: M x N array of fitted values
+    :param observed_matrix: M x N array of observed values, nan marks a missing point
+    :return: M values of R2, the squared correlation between fitted and observed
+    values as scipy.stats.linregress gives it
+    """
+    mask = np.isfinite(observed_matrix)
+    with np.errstate(all='ignore'):
+        fitted = np.where(mask, fitted_matrix, np.nan)
+        fitted = np.where(mask, fitted - np.nanmean(fitted, axis=-1, keepdims=True), 0)
+        observed = np.where(mask, observed_matrix - np.nanmean(observed_matrix, axis=-1, keepdims=True), 0)
+        r = np.sum(fitted*observed, axis=-1) / np.sqrt(np.sum(fitted**2, axis=-1) * np.sum(observed**2, axis=-1))
+    return r**2
+
+
+def fit_statistics(observed_matrix, fitted_matrix, pars, pcov, confidence=0.95):
+    """
+    :param observed_matrix: M x N array of observed values, nan marks a missing point
+    :param fitted_matrix: M x N array of fitted values
+    :param pars: M x P array of fitted parameters
+    :param pcov: M x P x P array of their covariances
+    :param confidence: level of the parameter confidence intervals
+    :return: structured array of M records with the fields n, r2, rss, rmse, aic,
+    bic, and pars, stderr, ci_low, ci_high (P values each)
+    Goodness of fit and parameter uncertainty of a whole batch of fits in one pass.
+    AIC and BIC are the least-squares forms n*ln(RSS/n) + 2P and n*ln(RSS/n) + P*ln(n).
+    """
+    import scipy.stats
+    observed_matrix = np.atleast_2d(observed_matrix)
+    pars = np.atleast_2d(pars)
+    pcov = np.reshape(pcov, (len(pars), pars.shape[1], pars.shape[1]))
+    num_pars = pars.shape[1]
+    dtype = np.dtype([('n', int), ('r2', float), ('rss', float), ('rmse', float), ('aic', float), ('bic', float),
+                      ('pars', float, num_pars), ('stderr', float, num_pars),
+                      ('ci_low', float, num_pars), ('ci_high', float, num_pars)])
+    stats = np.zeros(len(pars), dtype=dtype)
+
+    mask = np.isfinite(observed_matrix)
+    n = np.sum(mask, axis=-1)
+    with np.errstate(all='ignore'):
+        rss = np.sum(np.where(mask, observed_matrix - fitted_matrix, 0)**2, axis=-1)
+        log_likelihood_term = n * np.log(rss / n)
+        stderr = np.sqrt(np.diagonal(pcov, axis1=1, axis2=2))
+        dof = n - num_pars
+        t_value = scipy.stats.t.ppf(0.5 + confidence / 2, np.where(dof > 0, dof, np.nan))
+        stats['rmse'] = np.sqrt(rss / n)
+    stats['n'] = n
+    stats['r2'] = r_squared(fitted_matrix, observed_matrix)
+    stats['rss'] = rss
+    stats['aic'] = log_likelihood_term + 2 * num_pars
+    stats['bic'] = log_likelihood_term + num_pars * np.log(n)
+    stats['pars'] = pars
+    stats['stderr'] = stderr
+    stats['ci_low'] = pars - t_value[:, None] * stderr
+    stats['ci_high'] = pars + t_value[:, None] * stderr
+    return stats
+
+
+_worker_arrays = {}  # arrays in shared memory, as seen by a fit_parallel worker
+_worker_blocks = []  # the shared memory blocks behind them, kept open while the worker lives
+
+
+def _share_array(array):
+    """
+    :param array: numpy array to copy into a new shared memory block
+    :return: the block, a (name, shape, dtype) spec to attach to it, and a view of it
     """
-    pars, pcov = scipy.optimize.curve_fit(fitfunc, time_array, conc_array)
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, (block.name, array.shape, array.dtype.str), view
 
-    # Calculate r squared
-    fitted_data = fitfunc(time_array, pars[0], pars[1])
-    slope, intercept, r_value, p_value, std_err = scipy.stats.linregress(fitted_data, conc_array)
-    print("max = %.3E" % pars[0])
-    print("k = %.3E" % pars[1])
-    print("R2 = %.3E" % r_value**2)
-    return pars, r_value**2
+
+def _attach_arrays(specs):
+    # pool initializer: map the shared arrays of fit_parallel into this worker once
+    _worker_arrays.clear()
+    del _worker_blocks[:]
+    for key, (name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        _worker_blocks.append(block)
+        _worker_arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _fit_slice(start, end, model, jac, guess):
+    """
+    Fit reactions start to end - 1 of the shared arrays and write the results
+    into the shared output arrays.
+    :return: the number of reactions fitted
+    """
+    import scipy.optimize
+    a = _worker_arrays
+    offsets = a['offsets']
+    for i in range(start, end):
+        time_array = a['time'][offsets[i]:offsets[i+1]]
+        conc_array = a['conc'][offsets[i]:offsets[i+1]]
+        try:
+            p0 = initial_guess(conc_array, time_array) if guess else None
+            pars, pcov = scipy.optimize.curve_fit(model, time_array, conc_array, p0=p0, jac=jac)
+            a['pars'][i], a['pcov'][i] = pars, pcov
+            a['r2'][i] = r_squared(model(time_array, *pars), conc_array)
+            a['ok'][i] = True
+        except (RuntimeError, ValueError):
+            a['pars'][i], a['pcov'][i], a['r2'][i] = np.nan, np.nan, np.nan
+            a['ok'][i] = False
+    return end - start
+
+
+def fit_parallel(conc_arrays, time_arrays, model=fitfunc, jac=None, workers=None, chunks_per_worker=4):
+    """
+    :param conc_arrays: list of concentration arrays (may differ in length) or an M x N matrix
+    :param time_arrays: list of time arrays matching conc_arrays, or an M x N matrix
+    :param model: module-level model function f(x, *pars) for curve_fit
+    :param jac: Jacobian of the model, fitjac is used for fitfunc by default
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param chunks_per_worker: number of slices handed to each worker
+    :return: pars (M x P), pcov (M x P x P), r2 (M) and ok (M booleans)
+    Fit every reaction with curve_fit in a process pool.  The inputs are copied
+    into shared memory once and the workers write their results into shared
+    output arrays, so only slice bounds travel between the processes.
+    """
+    lengths = [len(conc_array) for conc_array in conc_arrays]
+    num_rxns = len(lengths)
+    num_pars = len(inspect.signature(model).parameters) - 1
+    guess = model is fitfunc
+    if guess and jac is None:
+        jac = fitjac
+    arrays = {
+        'time': np.concatenate([np.asarray(t, dtype=float) for t in time_arrays]) if num_rxns else np.zeros(0),
+        'conc': np.concatenate([np.asarray(c, dtype=float) for c in conc_arrays]) if num_rxns else np.zeros(0),
+        'offsets': np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+        'pars': np.zeros((num_rxns, num_pars)),
+        'pcov': np.zeros((num_rxns, num_pars, num_pars)),
+        'r2': np.zeros(num_rxns),
+        'ok': np.zeros(num_rxns, dtype=bool),
+    }
+    blocks, specs, views = [], {}, {}
+    try:
+        for key, array in arrays.items():
+            block, specs[key], views[key] = _share_array(array)
+            blocks.append(block)
+        workers = workers or os.cpu_count() or 1
+        bounds = np.linspace(0, num_rxns, min(num_rxns, workers * chunks_per_worker) + 1).astype(int)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_attach_arrays,
+                                                    initargs=(specs,)) as executor:
+            futures = [executor.submit(_fit_slice, start, end, model, jac, guess)
+                       for start, end in zip(bounds[:-1], bounds[1:])]
+            for future in futures:
+                future.result()
+        return (np.array(views['pars']), np.array(views['pcov']), np.array(views['r2']),
+                np.array(views['ok']))
+    finally:
+        views.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def fit_reactions(rxns, workers=None):
+    """
+    :param rxns: a list of Reaction objects, their time points may differ
+    :param workers: number of worker processes
+    :return: M x 2 array of the fitted parameters
+    Parallel counterpart of calling fit_plateau on every reaction.
+    """
+    for rxn in rxns:
+        rxn.calc_conc()
+    pars, pcov, r2, ok = fit_parallel([rxn.conc_array for rxn in rxns], [rxn.time_array for rxn in rxns],
+                                      workers=workers)
+    for rxn, rxn_pars, rxn_r2 in zip(rxns, pars, r2):
+        rxn.pars, rxn.r2 = rxn_pars, rxn_r2
+    return pars
 
 
 class Reaction:
@@ -51,6 +460,213 @@ class Reaction:
         return self.pars
 
 
+class ReactionSet:
+    """
+    Replicate reactions sharing the same number of time points, stored as 2-D
+    matrices with one row per reaction.  Indexing or iterating gives Reaction
+    objects whose arrays are views into the rows.
+    """
+    def __init__(self, time_matrix, cpm_matrix, sa, aa_conc):
+        self.time_matrix = np.ascontiguousarray(time_matrix, dtype=float)  # M x N time points
+        self.cpm_matrix = np.ascontiguousarray(cpm_matrix, dtype=float)  # M x N raw CPM
+        self.sa = np.asarray(sa, dtype=float)  # M specific activities
+        self.aa_conc = np.asarray(aa_conc, dtype=float)  # M amino acid concentrations
+        self.normalized_cpm_matrix = []  # raw CPM - the CPM of time 0
+        self.conc_matrix = []  # calculated concentration of charged tRNA
+        self.pars = []  # M x 2 fitted parameters
+        self.pcov = []  # M x 2 x 2 covariance of the fitted parameters
+        self.converged = []  # whether the fit of each reaction converged
+        self.r2 = []  # R squared of each reaction
+        self.stats = []  # goodness of fit and parameter uncertainty of each reaction, see fit_statistics
+        self._rxns = None  # per-reaction views, only built when asked for
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        :param columns: dict of the time, cpm, offsets, sa and conc columns
+        :return: a ReactionSet, sharing memory with the columns when possible
+        """
+        lengths = np.diff(columns['offsets'])
+        num_rxns = len(lengths)
+        if num_rxns and np.any(lengths != lengths[0]):
+            raise ValueError("reactions have different numbers of time points")
+        num_tp = int(lengths[0]) if num_rxns else 0
+        return cls(np.reshape(columns['time'], (num_rxns, num_tp)), np.reshape(columns['cpm'], (num_rxns, num_tp)),
+                   columns['sa'], columns['conc'])
+
+    @classmethod
+    def from_reactions(cls, rxns):
+        """
+        :param rxns: a list of Reaction objects with the same number of time points
+        :return: a ReactionSet
+        """
+        return cls([rxn.time_array for rxn in rxns], [rxn.cpm_array for rxn in rxns],
+                   [rxn.sa for rxn in rxns], [rxn.aa_conc for rxn in rxns])
+
+    @property
+    def rxns(self):
+        if self._rxns is None:
+            self._rxns = [Reaction(self.time_matrix[i], self.cpm_matrix[i], self.sa[i], self.aa_conc[i])
+                          for i in range(len(self))]
+            if len(self.conc_matrix):
+                self._share_conc()
+            if len(self.pars):
+                self._share_pars()
+        return self._rxns
+
+    def __len__(self):
+        return len(self.sa)
+
+    def __iter__(self):
+        return iter(self.rxns)
+
+    def __getitem__(self, i):
+        return self.rxns[i]
+
+    def calc_conc(self):
+        # Convert the CPM of all reactions to concentrations of charged tRNA at once
+        self.normalized_cpm_matrix = self.cpm_matrix - self.cpm_matrix[:, :1]
+        self.conc_matrix = self.normalized_cpm_matrix / self.sa[:, None] * self.aa_conc[:, None]
+        if self._rxns is not None:
+            self._share_conc()
+
+    def fit_plateau(self):
+        """
+        :return: M x 2 array of the fitted parameters of every reaction
+        Fit all reactions in one batch, see fit_batch.
+        """
+        self.calc_conc()
+        self.pars, self.pcov, self.converged = fit_batch(self.conc_matrix, self.time_matrix)
+        fitted_matrix = fitfunc(self.time_matrix, self.pars[:, :1], self.pars[:, 1:])
+        self.stats = fit_statistics(self.conc_matrix, fitted_matrix, self.pars, self.pcov)
+        self.r2 = self.stats['r2']
+        if self._rxns is not None:
+            self._share_pars()
+        return self.pars
+
+    def _share_conc(self):
+        for i, rxn in enumerate(self._rxns):
+            rxn.normalized_cpm_array = self.normalized_cpm_matrix[i]
+            rxn.conc_array = self.conc_matrix[i]
+
+    def _share_pars(self):
+        for i, rxn in enumerate(self._rxns):
+            rxn.pars = self.pars[i]
+            rxn.r2 = self.r2[i]
+
+
+class ReactionParser:
+    """
+    Line by line parser of the input format (see read_data) that can be fed
+    lines as they arrive.  It only holds the block being read.
+    """
+    def __init__(self):
+        self.aa_conc = 0  # concentration of total amino acid
+        self.time_array = []
+        self.cpm_array = []
+
+    def feed_line(self, line):
+        """
+        :param line: one line of the input file
+        :return: the Reaction closed by this line, or None
+        """
+        entries = line.split()
+        if not entries:
+            # skip blank lines
+            return None
+        time = entries[0]
+        cpm = entries[1]
+        if time == "conc":
+            # when the first item is "conc", initiate a new time and cpm array
+            # and set the conc to be the second item
+            self.time_array = []
+            self.cpm_array = []
+            self.aa_conc = float(cpm)
+        elif time == "sa":
+            # when the first item is "sa", hand over a new object of the Reaction class
+            # and drop the block so that it can be freed
+            rxn = Reaction(np.array(self.time_array), np.array(self.cpm_array), float(cpm), self.aa_conc)
+            self.time_array = []
+            self.cpm_array = []
+            return rxn
+        else:
+            # otherwise, read the first item as time, and the second item as cpm.
+            self.time_array.append(float(time))
+            self.cpm_array.append(float(cpm))
+        return None
+
+
+def iter_reactions(in_file_name):
+    """
+    :param in_file_name: input file name
+    :return: a generator of Reaction objects
+    Stream the input file one line at a time and yield each Reaction as soon as
+    its closing "sa" line is read, so only the current block is held in memory.
+    See read_data for the input format.
+    """
+    parser = ReactionParser()
+    with open(in_file_name, 'r') as ifile:
+        for line in ifile:
+            rxn = parser.feed_line(line)
+            if rxn is not None:
+                yield rxn
+
+
+class AssayWatcher:
+    """
+    Follow an input file that is still being written.  Every poll reads only
+    the bytes appended since the last one and parses the complete lines among
+    them; a file that shrank or was replaced is read again from the start.
+    """
+    def __init__(self, in_file_name):
+        self.in_file_name = in_file_name
+        self.rxns = []  # all reactions closed so far
+        self.reset()
+
+    def reset(self):
+        self.parser = ReactionParser()
+        self.offset = 0  # bytes of the file consumed so far
+        self.remainder = b''  # an incomplete last line, kept until its newline arrives
+        self.inode = None
+        del self.rxns[:]
+
+    def poll(self):
+        """
+        :return: list of the reactions closed since the last poll
+        A file that is missing for the moment (e.g. deleted to be written again)
+        gives no new reactions and is read from the start once it is back, and
+        lines that cannot be parsed are reported and skipped.
+        """
+        try:
+            stat = os.stat(self.in_file_name)
+            if self.inode is not None and (stat.st_ino != self.inode or stat.st_size < self.offset):
+                self.reset()
+            self.inode = stat.st_ino
+            if stat.st_size == self.offset:
+                return []
+            with open(self.in_file_name, 'rb') as ifile:
+                ifile.seek(self.offset)
+                data = ifile.read()
+        except OSError:
+            if self.inode is not None:
+                self.reset()
+            return []
+        self.offset += len(data)
+        lines = (self.remainder + data).split(b'\n')
+        self.remainder = lines.pop()
+        new_rxns = []
+        for line in lines:
+            try:
+                rxn = self.parser.feed_line(line.decode('ascii', 'replace'))
+            except (ValueError, IndexError):
+                sys.stderr.write("%s: skipping the line %r\n" % (self.in_file_name, line))
+                continue
+            if rxn is not None:
+                new_rxns.append(rxn)
+        self.rxns.extend(new_rxns)
+        return new_rxns
+
+
 def read_data(in_file_name):
     """
     :param in_file_name: input file name
@@ -68,54 +684,219 @@ def read_data(in_file_name):
     An input file may contain multiple replicates of the same experiment.  Their
     average and standard deviations will be calculated.
     """
-    # Initialization
-    rxns = []  # an array contains objects of Reaction class
+    return list(iter_reactions(in_file_name))
 
-    with open(in_file_name, 'r') as ifile:
-        aa_conc = 0  # concentration of total amino acid
-        for line in ifile.readlines():
-            entries = line.split()
-            time = entries[0]
-            cpm = entries[1]
-            if time == "conc":
-                # when the first item is "conc", initiate a new time and cpm array
-                # and set the conc to be the second item
-                time_array = []
-                cpm_array = []
-                aa_conc = float(cpm)
-            elif time == "sa":
-                # when the first item is "sa", generate a new object of the Reaction class
-                # and append it to the rxns array
-                rxns.append(Reaction(np.array(time_array), np.array(cpm_array), float(cpm), aa_conc))
-            else:
-                # otherwise, read the first item as time, and the second item as cpm.
-                """ Add an assertion """
-                time_array.append(float(time))
-                cpm_array.append(float(cpm))
-    return rxns
+
+def _two_per_line(data):
+    # whether every line of data that is not blank has exactly two entries
+    printable = np.frombuffer(data, dtype=np.uint8) > ord(' ')
+    start = printable.copy()
+    start[1:] &= ~printable[:-1]
+    # the line of the first character of every entry
+    line = np.searchsorted(np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n')), np.flatnonzero(start))
+    if len(line) % 2:
+        return False
+    return bool(np.all(line[0::2] == line[1::2]) and np.all(line[1:-1:2] < line[2::2]))
+
+
+def _columns_from_reactions(rxns):
+    # the columns of parse_columns built from a list of Reaction objects
+    lengths = [len(rxn.time_array) for rxn in rxns]
+    return {
+        'time': np.concatenate([rxn.time_array for rxn in rxns] + [np.empty(0)]).astype(float),
+        'cpm': np.concatenate([rxn.cpm_array for rxn in rxns] + [np.empty(0)]).astype(float),
+        'offsets': np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+        'sa': np.array([rxn.sa for rxn in rxns], dtype=float),
+        'conc': np.array([rxn.aa_conc for rxn in rxns], dtype=float),
+    }
+
+
+def parse_columns(in_file_name):
+    """
+    :param in_file_name: input file name
+    :return: dict of flat columns: time and cpm of all blocks back to back, the
+    offsets of each block into them, and one sa and conc value per block
+    Read the whole file in one go and parse it as a single float array, with the
+    keywords "conc" and "sa" mapped to nan and inf, then classify the rows with
+    numpy instead of branching line by line in Python.  A file where a line does
+    not have exactly two entries is handed to the line by line parser instead,
+    which ignores the extra entries as read_data does.
+    """
+    with open(in_file_name, 'rb') as ifile:
+        data = ifile.read()
+    try:
+        flat = parse_floats(data.replace(b'conc', b'nan').replace(b'sa', b'inf').decode('ascii'), in_file_name)
+    except ValueError:
+        flat = None
+    if flat is None or not _two_per_line(data):
+        return _columns_from_reactions(read_data(in_file_name))
+    rows = flat.reshape(-1, 2)
+    keys = rows[:, 0]
+    values = rows[:, 1]
+    is_conc = np.isnan(keys)
+    is_sa = np.isinf(keys)
+
+    conc_idx = np.flatnonzero(is_conc)
+    sa_idx = np.flatnonzero(is_sa)
+    point_idx = np.flatnonzero(~(is_conc | is_sa))
+
+    # the conc line that opens each block is the last one before its sa line
+    opener = np.searchsorted(conc_idx, sa_idx) - 1
+    aa_conc = np.where(opener >= 0, values[conc_idx[np.maximum(opener, 0)]], 0.0)
+    # a block starts after its conc line or after the previous sa line, whichever is later
+    block_start = np.where(opener >= 0, conc_idx[np.maximum(opener, 0)], -1)
+    block_start = np.maximum(block_start, np.concatenate(([-1], sa_idx[:-1])))
+
+    # assign every time point to the sa line that closes it and drop the orphans
+    block = np.searchsorted(sa_idx, point_idx)
+    closed = block < len(sa_idx)
+    point_idx, block = point_idx[closed], block[closed]
+    inside = point_idx > block_start[block]
+    point_idx, block = point_idx[inside], block[inside]
+
+    return {
+        'time': keys[point_idx],
+        'cpm': values[point_idx],
+        'offsets': np.concatenate(([0], np.cumsum(np.bincount(block, minlength=len(sa_idx))))).astype(np.int64),
+        'sa': values[sa_idx],
+        'conc': aa_conc,
+    }
+
+
+def reactions_from_columns(columns):
+    """
+    :param columns: dict of the time, cpm, offsets, sa and conc columns
+    :return: a list of Reaction objects whose arrays are slices of the columns
+    """
+    bounds = columns['offsets'][1:-1]
+    return [Reaction(t, c, sa, conc) for t, c, sa, conc in
+            zip(np.split(columns['time'], bounds), np.split(columns['cpm'], bounds),
+                np.asarray(columns['sa']).tolist(), np.asarray(columns['conc']).tolist())]
+
+
+def read_data_bulk(in_file_name):
+    """
+    :param in_file_name: input file name
+    :return: a list of Reaction objects, the same as read_data
+    """
+    return reactions_from_columns(parse_columns(in_file_name))
+
+
+CACHE_COLUMNS = ('time', 'cpm', 'offsets', 'sa', 'conc')
+
+
+def write_cache(columns, in_file_name, cache_dir):
+    """
+    :param columns: dict of the columns parsed from in_file_name
+    :param in_file_name: input file name
+    :param cache_dir: the sidecar directory to write
+    :return:
+    """
+    save_arrays(dict((name, columns[name]) for name in CACHE_COLUMNS), in_file_name, cache_dir)
 
 
-def print_data(counts_array, time_array, out_file_prefix):
+def load_cache(in_file_name, cache_dir):
+    """
+    :param in_file_name: input file name
+    :param cache_dir: the sidecar directory to read
+    :return: dict of memory-mapped columns, or None if the cache is missing or stale
+    """
+    return load_arrays(in_file_name, cache_dir, CACHE_COLUMNS)
+
+
+def read_columns_cached(in_file_name, cache_dir=None):
+    """
+    :param in_file_name: input file name
+    :param cache_dir: the sidecar cache directory, defaults to in_file_name + assay_io.CACHE_SUFFIX
+    :return: dict of the time, cpm, offsets, sa and conc columns
+    Reuse the columnar cache of an earlier run when it is still valid, otherwise
+    parse the file and write the cache.
+    """
+    return load_cached(in_file_name, parse_columns, CACHE_COLUMNS, cache_dir)
+
+
+def read_data_cached(in_file_name, cache_dir=None):
+    """
+    :param in_file_name: input file name
+    :param cache_dir: the sidecar cache directory, defaults to in_file_name + assay_io.CACHE_SUFFIX
+    :return: a list of Reaction objects, the same as read_data
+    """
+    return reactions_from_columns(read_columns_cached(in_file_name, cache_dir))
+
+
+def read_reaction_set(in_file_name, cache_dir=None):
+    """
+    :param in_file_name: input file name
+    :param cache_dir: the sidecar cache directory, defaults to in_file_name + assay_io.CACHE_SUFFIX
+    :return: a ReactionSet of all reactions in the file
+    """
+    return ReactionSet.from_columns(read_columns_cached(in_file_name, cache_dir))
+
+
+DATA_FORMATS = ('dat', 'npy', 'hdf5', 'parquet')
+
+
+def print_data(counts_array, time_array, out_file_prefix, out_format='dat'):
     """
     :param counts_array: array of raw counts
     :param time_array: array of time
     :param out_file_prefix: output file prefix
-    :return:
+    :param out_format: one of DATA_FORMATS
+    dat: tab-separated text, one table per reaction
+    npy: numpy arrays, the counts in -frac.npy and the time in -time.npy
+    hdf5: counts and time datasets in -frac.h5, chunked by reaction (needs h5py)
+    parquet: one row per reaction and time point with a column per lane in
+    -frac.parquet (needs pyarrow)
+    :return: list of the written file names
     """
-    # print the data
+    counts_array = np.asarray(counts_array, dtype=float)
+    time_array = np.asarray(time_array, dtype=float)
     num_rxns, num_tp, num_lanes = counts_array.shape
-    o_data_file_name = out_file_prefix + "-frac.dat"
-    with open(o_data_file_name, 'w') as ofile:
-        for rxn in range(num_rxns):
-            ofile.write("Time/Fraction\t1\t2\t3\t4\n")
-            for i in range(num_tp):
-                ofile.write("%.1f\t" % time_array[i])
-                for l in range(num_lanes):
-                    ofile.write("\t%.3f" % counts_array[rxn, i, l])
-                ofile.write("\n")
-
-
-def plot_multiple_fit(rxns, fig_prefix):
+    if out_format == 'dat':
+        o_data_file_name = out_file_prefix + "-frac.dat"
+        header = "Time/Fraction\t" + "\t".join(str(l + 1) for l in range(num_lanes)) + "\n"
+        # format a whole reaction at once instead of one write per cell
+        block_format = header + ("%.1f\t" + "\t%.3f" * num_lanes + "\n") * num_tp
+        rows = np.empty((num_tp, num_lanes + 1))
+        rows[:, 0] = time_array[:num_tp]
+        with open(o_data_file_name, 'w') as ofile:
+            for rxn in range(num_rxns):
+                rows[:, 1:] = counts_array[rxn]
+                ofile.write(block_format % tuple(rows.ravel().tolist()))
+        return [o_data_file_name]
+    if out_format == 'npy':
+        np.save(out_file_prefix + "-frac.npy", counts_array)
+        np.save(out_file_prefix + "-time.npy", time_array)
+        return [out_file_prefix + "-frac.npy", out_file_prefix + "-time.npy"]
+    if out_format == 'hdf5':
+        import h5py
+        o_data_file_name = out_file_prefix + "-frac.h5"
+        with h5py.File(o_data_file_name, 'w') as ofile:
+            chunks = (1, num_tp, num_lanes) if counts_array.size else None
+            ofile.create_dataset('counts', data=counts_array, chunks=chunks, compression='gzip', shuffle=True)
+            ofile.create_dataset('time', data=time_array)
+        return [o_data_file_name]
+    if out_format == 'parquet':
+        import pyarrow
+        import pyarrow.parquet
+        o_data_file_name = out_file_prefix + "-frac.parquet"
+        columns = {'rxn': np.repeat(np.arange(num_rxns), num_tp), 'time': np.tile(time_array[:num_tp], num_rxns)}
+        lanes = counts_array.reshape(num_rxns * num_tp, num_lanes)
+        for l in range(num_lanes):
+            columns[str(l + 1)] = lanes[:, l]
+        pyarrow.parquet.write_table(pyarrow.table(columns), o_data_file_name)
+        return [o_data_file_name]
+    raise ValueError("unknown data format %r, expected one of %s" % (out_format, ", ".join(DATA_FORMATS)))
+
+
+def replicate_matrix(rxns):
+    """
+    :param rxns: a ReactionSet, or a list of Reaction objects, after calc_conc
+    :return: time array and the M x N concentration matrix of the replicates
+    """
+    if isinstance(rxns, ReactionSet):
+        # the set already holds the M x N concentration matrix
+        return rxns.time_matrix[0], rxns.conc_matrix
     time_array = rxns[0].time_array
     num_rxns = len(rxns)
     num_data_points = len(time_array)
@@ -125,76 +906,565 @@ def plot_multiple_fit(rxns, fig_prefix):
     concat_conc_array = []
     for rxn in rxns:
         concat_conc_array.append(rxn.conc_array)
-    conc_matrix = np.reshape(concat_conc_array, [num_rxns, num_data_points])
+    return time_array, np.reshape(concat_conc_array, [num_rxns, num_data_points])
+
+
+def average_fit(rxns):
+    """
+    :param rxns: a ReactionSet, or a list of Reaction objects, after calc_conc
+    :return: time array, average and standard deviation of the concentration at
+    each time point, and the fitted parameters of the averaged curve and its R2
+    """
+    time_array, conc_matrix = replicate_matrix(rxns)
 
     # Calculate the average and standard deviation of each time point
     ave_conc_array = np.average(conc_matrix, axis=0)
     std_conc_array = np.std(conc_matrix, axis=0)
-
-    # plot
-    num_points = 1001
-    tt = np.linspace(0.0, np.amax(time_array), num_points)
     ave_pars, r2 = fit(ave_conc_array, time_array)
-    fitted_conc = fitfunc(tt, ave_pars[0], ave_pars[1])
-
-    # Plot
-    fig = plt.figure(figsize=(4, 4))
-    left, width = 0.2, 0.7
-    bottom, height = 0.2, 0.7
-    rect_scatter = [left, bottom, width, height]
-    ax = plt.axes(rect_scatter)
-
-    # plot the raw data
-    ax.errorbar(time_array, ave_conc_array, yerr=std_conc_array, marker='o', mfc='b', color='b',
-                ecolor='b', mec='b', linestyle='none')
-    # plot the fitted curve
-    plt.plot(tt, fitted_conc, ls='-', color='k', linewidth=1)
-
-    # x,y-axis limit (need to be automated)
-    ax.set_xlim(0, np.floor(np.amax(time_array))+1)
-    ax.set_ylim(0, 4)
-
-    plt.xticks([10, 20, 30])
-    ticklabels = ax.get_xticklabels()
-    ticklabels.extend(ax.get_yticklabels())
-    for label in ticklabels:
-        label.set_fontsize(12)
-    plt.xlabel('Time (min)', fontsize=16)
-    plt.ylabel('Charged tRNA (uM)', fontsize=16)
-
-    majorticks = ax.xaxis.get_majorticklines()
-    for majortickline in majorticks:
-        majortickline.set_linewidth(1)
-        majortickline.set_markeredgecolor('k')
-        majortickline.set_markeredgewidth(1)
-
-    majorticks = ax.yaxis.get_majorticklines()
-    for majortickline in majorticks:
-        majortickline.set_linewidth(1)
-        majortickline.set_markeredgecolor('k')
-        majortickline.set_markeredgewidth(1)
-
-    fig.savefig(fig_prefix+'.eps')
-    fig.savefig(fig_prefix+'.svg')
-
-
-def main():
-    # Read variables from the command line
+    return time_array, ave_conc_array, std_conc_array, ave_pars, r2
+
+
+def curve_grid(time_array, num_points=1001):
+    """
+    :return: the time points the fitted curve is drawn at
+    """
+    return np.linspace(0.0, np.amax(time_array), num_points)
+
+
+def adaptive_curve_grid(time_array, pars, rel_tol=1e-3, max_points=1001):
+    """
+    :param time_array: array of time
+    :param pars: parameters of fitfunc
+    :param rel_tol: allowed deviation of the straight segments from the curve,
+    relative to the largest value of the curve
+    :param max_points: upper bound of the number of points, as in curve_grid
+    :return: time points spaced so that linear interpolation between them stays within rel_tol
+    The error of a straight segment of width h is about h^2 |f''| / 8, so the
+    points are equidistributed in sqrt(|f''| / (8 tol)): dense where the plateau
+    model bends, sparse where it is flat.
+    """
+    fine = curve_grid(time_array, max_points)
+    p0, p1 = pars
+    curvature = np.abs(p0 * p1 * p1 * np.exp(-p1 * fine))
+    tol = rel_tol * max(np.amax(np.abs(fitfunc(fine, p0, p1))), np.finfo(float).tiny)
+    density = np.sqrt(curvature / (8 * tol))
+    # number of segments needed up to each fine point
+    needed = np.concatenate(([0.0], np.cumsum((density[1:] + density[:-1]) / 2 * np.diff(fine))))
+    if not np.isfinite(needed[-1]) or needed[-1] == 0:
+        # failed fit (nan parameters) or a straight line
+        return fine[[0, -1]]
+    num_segments = int(np.clip(np.ceil(needed[-1]), 1, max_points - 1))
+    return np.interp(np.linspace(0, needed[-1], num_segments + 1), needed, fine)
+
+
+def bootstrap_band(conc_matrix, time_array, num_samples=1000, confidence=0.95, seed=None, tt=None):
+    """
+    :param conc_matrix: M x N concentrations of the replicates
+    :param time_array: array of the N time points
+    :param num_samples: number of bootstrap resamples
+    :param confidence: coverage of the band
+    :param seed: seed of the resampling
+    :param tt: time points of the band, defaults to curve_grid
+    :return: the time points, lower and upper bound of the band on them, and
+    the num_samples x 2 fitted parameters of the resamples
+    Resample the replicates with replacement, fit the averaged curve of every
+    resample in one fit_batch call, and take percentiles of the fitted curves.
+    """
+    rng = np.random.default_rng(seed)
+    num_rxns = len(conc_matrix)
+    picks = rng.integers(0, num_rxns, size=(num_samples, num_rxns))
+    ave_conc_matrix = np.mean(np.asarray(conc_matrix)[picks], axis=1)
+    boot_pars, pcov, converged = fit_batch(ave_conc_matrix, time_array)
+
+    if tt is None:
+        tt = curve_grid(time_array)
+    curves = fitfunc(tt, boot_pars[:, :1], boot_pars[:, 1:])
+    tail = 50 * (1 - confidence)
+    lower, upper = np.nanpercentile(curves, [tail, 100 - tail], axis=0)
+    return tt, lower, upper, boot_pars
+
+
+FIT_FIGURE_STYLE = {
+    'color': 'b',  # color of the data points and their error bars
+    'line_color': 'k',  # color of the fitted curve
+    'ylim': (0, 4),
+    'xticks': (10, 20, 30),
+    'xlabel': 'Time (min)',
+    'ylabel': 'Charged tRNA (uM)',
+    'label_fontsize': 16,
+    'tick_fontsize': 12,
+    'band_color': '0.8',  # color of the bootstrap confidence band
+    'curve_tol': None,  # relative tolerance of adaptive_curve_grid, None for 1001 even points
+    'simplify_threshold': None,  # path simplification threshold in pixels, None for the matplotlib default
+}
+COMPACT_FIGURE_STYLE = {'curve_tol': 1e-3, 'simplify_threshold': 0.5}  # smaller vector output
+
+
+class FitFigureTemplate:
+    """
+    A styled figure of averaged data with error bars and the fitted curve.  The
+    figure, axes, ticks and labels are built once; update only replaces the data
+    of the error bars and of the fitted line, so one template can be saved for
+    many datasets.
+    """
+    def __init__(self, style=None):
+        plt = pyplot()
+        self.style = dict(FIT_FIGURE_STYLE, **(style or {}))
+        self.fig = plt.figure(figsize=(4, 4))
+        left, width = 0.2, 0.7
+        bottom, height = 0.2, 0.7
+        rect_scatter = [left, bottom, width, height]
+        self.ax = self.fig.add_axes(rect_scatter)
+
+        # the raw data and the fitted curve, filled in by update
+        color = self.style['color']
+        self.errorbar = self.ax.errorbar(np.zeros(0), np.zeros(0), yerr=np.zeros(0), marker='o', mfc=color,
+                                         color=color, ecolor=color, mec=color, linestyle='none')
+        self.line, = self.ax.plot([], [], ls='-', color=self.style['line_color'], linewidth=1)
+        self.band = None  # confidence band of the fitted curve, see update
+
+        # x,y-axis limit (x is set by update)
+        self.ax.set_ylim(*self.style['ylim'])
+        self.ax.set_xticks(self.style['xticks'])
+        # tick_params sticks to ticks created later, unlike styling the current tick lines
+        self.ax.tick_params(which='major', labelsize=self.style['tick_fontsize'], width=1, color='k')
+        self.ax.set_xlabel(self.style['xlabel'], fontsize=self.style['label_fontsize'])
+        self.ax.set_ylabel(self.style['ylabel'], fontsize=self.style['label_fontsize'])
+
+    def update(self, time_array, ave_conc_array, std_conc_array, ave_pars, band=None):
+        """
+        :param time_array: array of time
+        :param ave_conc_array: average concentration at each time point
+        :param std_conc_array: standard deviation of the concentration at each time point
+        :param ave_pars: fitted parameters of the averaged curve
+        :param band: optional (tt, lower, upper) confidence band of the fitted curve
+        :return:
+        """
+        time_array = np.asarray(time_array, dtype=float)
+        lower = ave_conc_array - std_conc_array
+        upper = ave_conc_array + std_conc_array
+        data_line, caplines, barlinecols = self.errorbar.lines
+        data_line.set_data(time_array, ave_conc_array)
+        barlinecols[0].set_segments(np.stack((np.stack((time_array, lower), axis=-1),
+                                              np.stack((time_array, upper), axis=-1)), axis=1))
+        if caplines:
+            caplines[0].set_data(time_array, lower)
+            caplines[1].set_data(time_array, upper)
+
+        tt = self.curve_grid(time_array, ave_pars)
+        self.line.set_data(tt, fitfunc(tt, ave_pars[0], ave_pars[1]))
+        self.ax.set_xlim(0, np.floor(np.amax(time_array))+1)
+
+        # a filled band has no data setter on every matplotlib version, so replace it
+        if self.band is not None:
+            self.band.remove()
+            self.band = None
+        if band is not None:
+            self.band = self.ax.fill_between(*band, color=self.style['band_color'], linewidth=0, zorder=1)
+
+    def curve_grid(self, time_array, ave_pars):
+        """
+        :return: the time points of the fitted curve under this style
+        """
+        if self.style['curve_tol'] is None:
+            return curve_grid(time_array)
+        return adaptive_curve_grid(time_array, ave_pars, self.style['curve_tol'])
+
+    def save(self, fig_prefix, formats=DEFAULT_FORMATS, threads=False, close=False):
+        """
+        :return: list of the written file names, the template stays open for the next update unless close
+        """
+        import matplotlib
+        rc = {}
+        if self.style['simplify_threshold'] is not None:
+            rc = {'path.simplify': True, 'path.simplify_threshold': self.style['simplify_threshold']}
+        with matplotlib.rc_context(rc):
+            return export_figure(self.fig, fig_prefix, formats, threads, close=close)
+
+    def close(self):
+        pyplot().close(self.fig)
+
+
+def draw_fit_figure(time_array, ave_conc_array, std_conc_array, ave_pars, fig_prefix,
+                    formats=DEFAULT_FORMATS, threads=False, style=None, band=None):
+    """
+    :param time_array: array of time
+    :param ave_conc_array: average concentration at each time point
+    :param std_conc_array: standard deviation of the concentration at each time point
+    :param ave_pars: fitted parameters of the averaged curve
+    :param fig_prefix: output figure prefix
+    :param formats: figure formats to write, see export_figure
+    :param threads: whether to write the formats concurrently
+    :param style: dict overriding entries of FIT_FIGURE_STYLE
+    :param band: optional (tt, lower, upper) confidence band of the fitted curve
+    :return: list of the written file names
+    Draw a single figure; use a FitFigureTemplate directly for many of them.
+    """
+    template = FitFigureTemplate(style)
+    template.update(time_array, ave_conc_array, std_conc_array, ave_pars, band)
+    return template.save(fig_prefix, formats, threads, close=True)
+
+
+def plot_multiple_fit(rxns, fig_prefix, formats=DEFAULT_FORMATS, threads=False, bootstrap=0, seed=None,
+                      style=None):
+    """
+    :param rxns: a ReactionSet, or a list of Reaction objects, after calc_conc
+    :param fig_prefix: output figure prefix
+    :param formats: figure formats to write, see export_figure
+    :param threads: whether to write the formats concurrently
+    :param bootstrap: number of bootstrap resamples of the replicates for a 95%
+    confidence band of the fitted curve, 0 for no band
+    :param seed: seed of the bootstrap resampling
+    :param style: dict overriding entries of FIT_FIGURE_STYLE
+    :return: the fitted parameters of the averaged curve and its R2
+    """
+    time_array, ave_conc_array, std_conc_array, ave_pars, r2 = average_fit(rxns)
+    band = fit_band(rxns, time_array, ave_pars, bootstrap, seed, style)
+    draw_fit_figure(time_array, ave_conc_array, std_conc_array, ave_pars, fig_prefix, formats, threads,
+                    style=style, band=band)
+    return ave_pars, r2
+
+
+def fit_band(rxns, time_array, ave_pars, bootstrap, seed=None, style=None):
+    """
+    :return: the (tt, lower, upper) bootstrap band of the fitted curve for the
+    figure style, or None when bootstrap is 0
+    """
+    if not bootstrap:
+        return None
+    tt = None
+    if style and style.get('curve_tol') is not None:
+        tt = adaptive_curve_grid(time_array, ave_pars, style['curve_tol'])
+    tt, lower, upper, boot_pars = bootstrap_band(replicate_matrix(rxns)[1], time_array, bootstrap, seed=seed, tt=tt)
+    return tt, lower, upper
+
+
+FigureJob = collections.namedtuple('FigureJob', ['fig_prefix', 'time_array', 'ave_conc_array',
+                                                 'std_conc_array', 'ave_pars', 'style'])
+FigureJob.__new__.__defaults__ = (None,)  # style
+
+
+def figure_job(rxns, fig_prefix, style=None):
+    """
+    :param rxns: a ReactionSet, or a list of Reaction objects, after calc_conc
+    :param fig_prefix: output figure prefix
+    :param style: dict overriding entries of FIT_FIGURE_STYLE
+    :return: a FigureJob holding only the arrays the figure needs
+    """
+    time_array, ave_conc_array, std_conc_array, ave_pars, r2 = average_fit(rxns)
+    return FigureJob(fig_prefix, np.asarray(time_array, dtype=float), ave_conc_array, std_conc_array,
+                     np.asarray(ave_pars, dtype=float), style)
+
+
+_worker_templates = {}  # FitFigureTemplate of each style, kept by a render_figures worker
+
+
+def _warm_renderer():
+    # pool initializer: load pyplot and build the font cache once per worker
+    _worker_templates.clear()
+    _worker_templates[repr(None)] = template = FitFigureTemplate()
+    template.fig.canvas.draw()
+
+
+def _render_job(job, formats):
+    start = time.perf_counter()
+    key = repr(sorted(job.style.items())) if job.style else repr(None)
+    if key not in _worker_templates:
+        _worker_templates[key] = FitFigureTemplate(job.style)
+    template = _worker_templates[key]
+    template.update(job.time_array, job.ave_conc_array, job.std_conc_array, job.ave_pars)
+    file_names = template.save(job.fig_prefix, formats)
+    return file_names, time.perf_counter() - start
+
+
+def render_figures(jobs, workers=None, formats=DEFAULT_FORMATS):
+    """
+    :param jobs: list of FigureJob
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param formats: figure formats to write
+    :return: a list of (fig_prefix, file names, seconds, error) in job order
+    Draw the figures in a process pool whose workers keep matplotlib loaded and
+    reuse one FitFigureTemplate per style between jobs.  A figure that fails
+    only records its error.
+    """
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_warm_renderer) as executor:
+        futures = [executor.submit(_render_job, job, formats) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                file_names, seconds = future.result()
+                results.append((job.fig_prefix, file_names, seconds, None))
+            except Exception as err:
+                results.append((job.fig_prefix, [], 0.0, "%s: %s" % (type(err).__name__, err)))
+    return results
+
+
+def process_file(in_file_name, out_file_prefix, plot=True, formats=DEFAULT_FORMATS, bootstrap=0, style=None,
+                 recorder=None, layout=None, profile_name=None):
+    """
+    :param in_file_name: input file name, or a plate reader export with layout
+    :param out_file_prefix: output file prefix
+    :param plot: whether to plot; without plotting matplotlib is never imported
+    :param formats: figure formats to write
+    :param bootstrap: number of bootstrap resamples for the confidence band, 0 for none
+    :param style: dict overriding entries of FIT_FIGURE_STYLE
+    :param recorder: a StageRecorder timing the parse, calc_conc, fit and plot stages
+    :param layout: a plate_io.PlateLayout to read the input as a stack of raw plates
+    :param profile_name: name of the profile dumps of the file, see StageRecorder.run
+    :return: the number of reactions, the fitted parameters of the averaged curve and its R2
+    """
+    if recorder is None:
+        recorder = StageRecorder()
+    with recorder.run(in_file_name, profile_name):
+        # read the data, reusing the cache of an earlier run when possible
+        with recorder.stage('parse') as counts:
+            if layout is None:
+                hits = load_counters['hits']
+                rxns = read_reaction_set(in_file_name)
+                counts['cache_hit'] = load_counters['hits'] > hits
+            else:
+                plates = read_plates(in_file_name, layout.size)
+                rxns = ReactionSet.from_columns(layout.reaction_columns(plates))
+                counts['plates'] = len(plates)
+                counts['cache_hit'] = False
+            # a cache hit memory-maps the arrays and parses nothing
+            counts['bytes_parsed'] = 0 if counts['cache_hit'] else os.path.getsize(in_file_name)
+            counts['reactions'] = len(rxns)
+
+        # Calculate the concentration of charged tRNA from CPM for all reactions at once
+        with recorder.stage('calc_conc') as counts:
+            rxns.calc_conc()
+            counts['reactions'] = len(rxns)
+
+        with recorder.stage('fit') as counts:
+            before = fit_counters.copy()
+            time_array, ave_conc_array, std_conc_array, pars, r2 = average_fit(rxns)
+            band = fit_band(rxns, time_array, pars, bootstrap, style=style) if plot else None
+            counts['fits'] = fit_counters['fits'] - before['fits']
+            counts['evaluations'] = fit_counters['evaluations'] - before['evaluations']
+
+        if plot:
+            with recorder.stage('plot') as counts:
+                file_names = draw_fit_figure(time_array, ave_conc_array, std_conc_array, pars, out_file_prefix,
+                                             formats, style=style, band=band)
+                counts['bytes_written'] = file_bytes(file_names)
+    return len(rxns), pars, r2
+
+
+def list_batch_files(in_path, pattern='*.dat'):
+    """
+    :param in_path: a directory or a glob pattern
+    :param pattern: glob pattern of the files to take when in_path is a directory; not
+    every file, as the figures of an earlier batch may have been written there
+    :return: sorted list of input file names
+    """
+    if os.path.isdir(in_path):
+        in_path = os.path.join(in_path, pattern)
+    return sorted(f for f in glob.glob(in_path) if os.path.isfile(f))
+
+
+def output_names(in_file_names):
+    """
+    :param in_file_names: list of input file names
+    :return: list of the output names of the files, relative to the output directory
+    The files are named after their stem.  When two stems clash, e.g. for
+    runs/*/export.dat, every file keeps its path relative to the directory
+    common to all of them, and its extension too if that is not enough.
+    """
+    names = [os.path.splitext(os.path.basename(in_file_name))[0] for in_file_name in in_file_names]
+    if len(set(names)) == len(names):
+        return names
+    paths = [os.path.abspath(in_file_name) for in_file_name in in_file_names]
+    common = os.path.commonpath([os.path.dirname(path) for path in paths])
+    names = [os.path.splitext(os.path.relpath(path, common))[0] for path in paths]
+    if len(set(names)) == len(names):
+        return names
+    return [os.path.relpath(path, common).replace('.', '_') for path in paths]
+
+
+def run_batch(in_file_names, out_dir, workers=None, fit_cache_dir=None, plot=True, formats=DEFAULT_FORMATS,
+              bootstrap=0, style=None, recorder=None, layout=None):
+    """
+    :param in_file_names: list of input file names
+    :param out_dir: directory of the output figures, named after the input files (see output_names)
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param fit_cache_dir: on-disk fit cache shared by the workers
+    :param plot: whether to plot, out_dir is not used without plotting
+    :param formats: figure formats to write
+    :param bootstrap: number of bootstrap resamples for the confidence band, 0 for none
+    :param style: dict overriding entries of FIT_FIGURE_STYLE
+    :param recorder: a StageRecorder used by the workers for every file
+    :param layout: a plate_io.PlateLayout shared by all the input files, see process_file
+    :return: a list of (file name, number of reactions, pars, r2, error) in input order
+    A file that fails to process only records its error and does not stop the batch.
+    """
+    if plot:
+        os.makedirs(out_dir, exist_ok=True)
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=use_fit_cache_dir,
+                                                initargs=(fit_cache_dir,)) as executor:
+        futures = []
+        for in_file_name, out_name in zip(in_file_names, output_names(in_file_names)):
+            out_file_prefix = None
+            if plot:
+                out_file_prefix = os.path.join(out_dir, out_name)
+                os.makedirs(os.path.dirname(out_file_prefix), exist_ok=True)
+            # the profile dumps of a file are named like its figures, so that clashing stems stay apart
+            futures.append(executor.submit(process_file, in_file_name, out_file_prefix, plot, formats,
+                                           bootstrap, style, recorder, layout, out_name.replace(os.sep, '_')))
+        for in_file_name, future in zip(in_file_names, futures):
+            try:
+                num_rxns, pars, r2 = future.result()
+                results.append((in_file_name, num_rxns, pars, r2, None))
+            except Exception as err:
+                results.append((in_file_name, 0, None, None, "%s: %s" % (type(err).__name__, err)))
+    return results
+
+
+def print_summary(results, ofile=None):
+    """
+    :param results: output of run_batch
+    :param ofile: where to write the table, defaults to the current sys.stdout
+    :return:
+    """
+    ofile = ofile or sys.stdout
+    ofile.write("File\tRxns\tmax\tk\tR2\tStatus\n")
+    for in_file_name, num_rxns, pars, r2, error in results:
+        if error is None:
+            ofile.write("%s\t%d\t%.3E\t%.3E\t%.3E\tok\n" % (in_file_name, num_rxns, pars[0], pars[1], r2))
+        else:
+            ofile.write("%s\t%d\t-\t-\t-\t%s\n" % (in_file_name, num_rxns, error))
+
+
+def watch(in_file_name, out_file_prefix, interval=2.0, plot=True, formats=DEFAULT_FORMATS, style=None,
+          max_polls=None):
+    """
+    :param in_file_name: input file name, may still be growing
+    :param out_file_prefix: output file prefix
+    :param interval: seconds between two polls of the file
+    :param plot: whether to redraw the figure
+    :param formats: figure formats to write
+    :param style: dict overriding entries of FIT_FIGURE_STYLE
+    :param max_polls: stop after this many polls, None to run until interrupted
+    :return: the last fitted parameters of the averaged curve and its R2, or None
+    Only the reactions closed since the last poll are fitted, and the averaged
+    curve is refitted and redrawn only when it changed.  A reaction that cannot be
+    fitted is reported and left out of the average, and the watch goes on.
+    """
+    watcher = AssayWatcher(in_file_name)
+    failed = set()  # indices of the reactions that could not be fitted
+    result = None
+    polls = 0
     try:
-        in_file_name = sys.argv[1]
-        out_file_prefix = sys.argv[2]
-    except IOError:
-        print("Usage: ", sys.argv[0], "input file, output file prefix")
-        sys.exit(1)
+        while max_polls is None or polls < max_polls:
+            polls += 1
+            num_known = len(watcher.rxns)
+            new_rxns = watcher.poll()
+            if len(watcher.rxns) < num_known + len(new_rxns):
+                print("%s was rewritten, reading it again" % in_file_name)
+                failed.clear()
+            first = len(watcher.rxns) - len(new_rxns)
+            for i, rxn in enumerate(new_rxns):
+                try:
+                    rxn.fit_plateau()
+                except (RuntimeError, ValueError, TypeError) as err:
+                    failed.add(first + i)
+                    print("rxn %d: cannot be fitted, left out: %s" % (first + i + 1, err))
+                    continue
+                print("rxn %d: max = %.3E, k = %.3E, R2 = %.3E" % (first + i + 1, rxn.pars[0], rxn.pars[1], rxn.r2))
+            if new_rxns:
+                fitted = [rxn for i, rxn in enumerate(watcher.rxns) if i not in failed]
+                try:
+                    if not fitted:
+                        raise ValueError("no reaction could be fitted")
+                    time_array, ave_conc_array, std_conc_array, pars, r2 = average_fit(fitted)
+                except (RuntimeError, ValueError, TypeError) as err:
+                    print("cannot average the reactions yet: %s" % err)
+                else:
+                    if result is None or not np.array_equal(pars, result[0]):
+                        result = (pars, r2)
+                        print("average of %d: max = %.3E, k = %.3E, R2 = %.3E" % (len(fitted), pars[0], pars[1], r2))
+                        if plot:
+                            draw_fit_figure(time_array, ave_conc_array, std_conc_array, pars, out_file_prefix,
+                                            formats, style=style)
+            if max_polls is None or polls < max_polls:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return result
 
-    # read the data
-    rxns = read_data(in_file_name)
 
-    for rxn in rxns:
-        # Calculate the concentration of charged tRNA from CPM
-        rxn.calc_conc()
+def build_parser():
+    # Read variables from the command line
+    parser = argparse.ArgumentParser(description="Plot triplicated aminoacylation assays")
+    parser.add_argument('in_file_name', help="input file, or a directory/glob of input files with --batch")
+    parser.add_argument('out_file_prefix', nargs='?', default=None,
+                        help="output file prefix, or the output directory with --batch")
+    parser.add_argument('--batch', action='store_true', help="process every input file in a worker pool")
+    parser.add_argument('--pattern', default='*.dat',
+                        help="files to take from an input directory (default: *.dat, so that the figures of an "
+                             "earlier batch written to the same directory are not taken as input)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--fit-cache', metavar='DIR', default=None,
+                        help="directory to share fit results across runs")
+    parser.add_argument('--no-plot', dest='plot', action='store_false',
+                        help="only fit and print the results, without importing matplotlib")
+    parser.add_argument('--formats', type=parse_formats, default=DEFAULT_FORMATS,
+                        help="comma-separated figure formats among eps, svg, svgz, pdf, png (default: eps,svg)")
+    parser.add_argument('--compact', action='store_true',
+                        help="sample the fitted curve adaptively and simplify paths for smaller vector files")
+    parser.add_argument('--watch', metavar='SECONDS', type=float, nargs='?', const=2.0, default=None,
+                        help="follow a growing input file, polling every SECONDS (default: 2), until interrupted")
+    parser.add_argument('--bootstrap', metavar='N', type=int, default=0,
+                        help="draw a 95%% confidence band from N bootstrap resamples of the replicates")
+    parser.add_argument('--layout', metavar='FILE', default=None,
+                        help="read the inputs as stacks of raw plates, with the wells assigned to reactions "
+                             "and time points by the layout map FILE (see plate_io)")
+    parser.add_argument('--plate', type=int, choices=sorted(PLATE_SHAPES), default=None,
+                        help="plate size of --layout (default: guessed from the wells of the layout)")
+    parser.add_argument('--stats', metavar='FILE', default=None,
+                        help="append wall/CPU time, memory and counts of every stage to FILE as json lines")
+    parser.add_argument('--profile', metavar='PREFIX', default=None,
+                        help="write cProfile and tracemalloc dumps of every input file to PREFIX.<file>.*")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    recorder = StageRecorder(args.stats, args.profile)
+    style = COMPACT_FIGURE_STYLE if args.compact else None
+    if args.plot and args.out_file_prefix is None:
+        parser.error("an output file prefix is needed unless --no-plot is given")
+    if args.layout is not None and args.watch is not None:
+        parser.error("--watch reads conc/sa files and cannot be combined with --layout")
+    layout = PlateLayout.from_file(args.layout, args.plate) if args.layout is not None else None
 
-    plot_multiple_fit(rxns, out_file_prefix)
+    if args.watch is not None:
+        use_fit_cache_dir(args.fit_cache)
+        watch(args.in_file_name, args.out_file_prefix, args.watch, args.plot, args.formats, style)
+        return
+
+    if not args.batch:
+        use_fit_cache_dir(args.fit_cache)
+        num_rxns, pars, r2 = process_file(args.in_file_name, args.out_file_prefix, args.plot,
+                                          args.formats, args.bootstrap, style, recorder, layout)
+        print("max = %.3E" % pars[0])
+        print("k = %.3E" % pars[1])
+        print("R2 = %.3E" % r2)
+        if args.fit_cache is not None:
+            sys.stderr.write("fit cache: %s\n" % ", ".join("%s=%d" % item for item in fit_cache.stats().items()))
+        return
+
+    in_file_names = list_batch_files(args.in_file_name, args.pattern)
+    if not in_file_names:
+        print("No input files match", args.in_file_name)
+        sys.exit(1)
+    results = run_batch(in_file_names, args.out_file_prefix, args.workers, args.fit_cache, args.plot,
+                        args.formats, args.bootstrap, style, recorder, layout)
+    print_summary(results)
+    if any(error is not None for _, _, _, _, error in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":